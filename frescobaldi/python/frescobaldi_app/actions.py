@@ -35,8 +35,6 @@ from PyKDE4.kdeui import (
     KdePrint, KDialog, KIcon, KMessageBox, KStandardGuiItem, KVBox)
 from PyKDE4.kio import KRun
 
-import ly.parse
-
 from kateshell.mainwindow import addAccelerators
 
 
@@ -167,8 +165,10 @@ class EmailDialog(KDialog):
             "the LilyPond source document). Also LilyPond files included "
             "by the source document are shown."))
         
-        lyFiles = ly.parse.findIncludeFiles(updatedFiles.lyfile,
+        includeGraph = parent.app.includeGraph()
+        lyFiles = includeGraph.find(updatedFiles.lyfile,
             config("preferences").readPathEntry("lilypond include path", []))
+        includeGraph.save()
         pdfFiles = updatedFiles("pdf")
         midiFiles = updatedFiles("mid*")
         
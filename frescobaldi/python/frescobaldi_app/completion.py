@@ -184,7 +184,7 @@ def findMatches(model, view, word, invocationType):
     if re.search(r'\\key\s+[a-z]+\s*\\$', text):
         return ly.words.modes
     if re.search(r'\\(un)?set\b\s*$', text):
-        return ly.words.contexts + ly.words.contextproperties
+        return ly.words.contexts_properties_index
     if re.search(r'\\(new|change|context)\s+$', text):
         return ly.words.contexts
     if ly.words.set_context_re.search(text):
@@ -198,7 +198,7 @@ def findMatches(model, view, word, invocationType):
         if re.search(r"\\tweak\b\s*$", text[:-2]):
             return ly.words.schemeprops()
     if re.search(r"\\(override|revert)\s+$", text):
-        return ly.words.contexts + ly.words.grobs
+        return ly.words.contexts_grobs_index
     if re.search(r'\\repeat\s+"?$', text):
         return ly.words.repeat_types
     if re.search(r'\\clef\s*"$', text):
@@ -211,12 +211,10 @@ def findMatches(model, view, word, invocationType):
         return ColorCompletions(model, ly.colors.colors_x11)
     if re.search(r"#'break-visibility\s*=\s*#$", text):
         return ly.words.break_visibility
-    # parse to get current context
-    fragment = doc.text(KTextEditor.Range(KTextEditor.Cursor(0, 0),
-        word.start())) or "" # KatePart returns None instead of empty string
-    tokenizer = ly.tokenize.Tokenizer()
+    # parse the current line to get current context
+    tokenizer = model.doc.tokenCache().lineTokenizer(line)
     token = None # in case the next loop does not run at all
-    for token in tokenizer.tokens(fragment):
+    for token in tokenizer.tokens(text):
         pass
     # don't bother if we are inside a string or comment
     if isinstance(token, (tokenizer.String, tokenizer.Comment)):
@@ -225,16 +223,10 @@ def findMatches(model, view, word, invocationType):
     if text.endswith("\\"):
         if isinstance(tokenizer.parser(), tokenizer.MarkupParser):
             if tokenizer.parser().token == "\\markuplines":
-                return ly.words.markupcommands + ly.words.markuplistcommands
+                return ly.words.markupallcommands_index
             else:
                 return ly.words.markupcommands
-        commands = (ly.words.keywords + ly.words.keywords_completion
-            + ly.words.musiccommands + ly.words.musiccommands_completion
-            + lilyPondVersion())
-        if tokenizer.parser().token == "\\context":
-            return commands + ly.words.contexts
-        else:
-            return commands
+        return commands(tokenizer.parser().token == "\\context")
 
     if isinstance(tokenizer.parser(), tokenizer.SchemeParser):
         # is the last token the scheme-introducing '#' ?
@@ -278,3 +270,20 @@ def lilyPondVersion():
     ver = frescobaldi_app.version.defaultVersion()
     return ('version "{0}"'.format(ver),) if ver else ()
 
+_commands = {}
+
+def commands(context=False):
+    """
+    Returns a ly.words.WordIndex with the commands to complete after a
+    backslash, including contexts if context is True.
+    """
+    key = lilyPondVersion(), context
+    try:
+        return _commands[key]
+    except KeyError:
+        wordlists = [ly.words.commands_index, key[0]]
+        if context:
+            wordlists.append(ly.words.contexts)
+        index = _commands[key] = ly.words.WordIndex(*wordlists)
+        return index
+
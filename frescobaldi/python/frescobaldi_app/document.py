@@ -33,7 +33,7 @@ from PyKDE4.kdeui import KDialog, KIcon, KMessageBox
 from PyKDE4.ktexteditor import KTextEditor
 
 import ly.rx, ly.dynamic, ly.pitch, ly.parse, ly.tokenize, ly.tools, ly.version
-from kateshell.app import cacheresult
+from kateshell.app import cacheresult, cursorToPosition
 from kateshell.widgets import promptText
 from kateshell.mainwindow import addAccelerators
 from frescobaldi_app.mainapp import lilyPondCommand, lilyPondVersion
@@ -68,7 +68,8 @@ class DocumentManipulator(object):
         newSyntax = (self.doc.lilyPondVersion() or lilyPondVersion()) >= (2, 13, 38)
         text, start = self.doc.selectionOrDocument()
         try:
-            changes, includeCommandChanged = ly.tools.translate(text, lang, start)
+            changes, includeCommandChanged = ly.tools.translate(text, lang, start,
+                tokenizer=self.selectionTokenizer(ly.tokenize.Tokenizer(), start))
         except ly.QuarterToneAlterationNotAvailable:
             KMessageBox.sorry(self.doc.app.mainwin, i18n(
                 "Can't perform the requested translation.\n\n"
@@ -122,7 +123,7 @@ class DocumentManipulator(object):
         """
         insert = 0
         tokenizer = ly.tokenize.LineColumnTokenizer()
-        for token in tokenizer.tokens(self.doc.text()):
+        for token in self.doc.tokenCache().tokens(tokenizer):
             if (isinstance(token, tokenizer.Space)
                 and tokenizer.depth() == (1, 0)
                 and token.count('\n') > 1):
@@ -137,7 +138,7 @@ class DocumentManipulator(object):
         of parsers, level).
         """
         tokenizer = RangeTokenizer()
-        for token in tokenizer.tokens(self.doc.text()):
+        for token in self.doc.tokenCache().tokens(tokenizer):
             if (isinstance(token, tokenizer.Space)
                 and tokenizer.depth() <= depth
                 and token.count('\n') > 1):
@@ -159,10 +160,7 @@ class DocumentManipulator(object):
         # find out in what input mode we are
         mode = ""
         selRange = self.doc.view.selectionRange() # copy othw. crash in KDE 4.3 /PyQt 4.5.x.
-        text = self.doc.textToCursor(selRange.start())
-        tokenizer = ly.tokenize.Tokenizer()
-        for token in tokenizer.tokens(text):
-            pass
+        tokenizer = self.doc.tokenCache().tokenizer(selRange.start())
         for s in reversed(tokenizer.state):
             if isinstance(s, tokenizer.InputModeParser):
                 if isinstance(s, tokenizer.LyricModeParser):
@@ -223,9 +221,7 @@ class DocumentManipulator(object):
         result = matchObj.group('chord')
         
         # remove octave mark from first pitch if in relative mode
-        tokenizer = RelativeTokenizer()
-        for token in tokenizer.tokens(self.doc.textToCursor()):
-            pass
+        tokenizer = self.doc.tokenCache().tokenizer()
         if isinstance(tokenizer.parser(), tokenizer.RelativeParser):
             result = re.sub(ly.rx.named_pitch,
                 lambda m: m.group('step') + m.group('cautionary'), result, 1)
@@ -379,23 +375,28 @@ class DocumentManipulator(object):
             selRange = self.doc.view.selectionRange() # copy othw. crash in KDE 4.3 /PyQt 4.5.x.
             cursor = selRange.start()
             startline = cursor.line()
-            # find out if the selected snippet is scheme code
-            tokenizer = ly.tokenize.Tokenizer()
-            for token in tokenizer.tokens(self.doc.textToCursor(cursor)):
-                pass
-            startscheme = isinstance(tokenizer.parser(), tokenizer.SchemeParser)
             text = self.doc.selectionText()
+            # indent the lines as if the whole document was indented
+            indenter = self.doc.indenter()
+            state = self.doc.tokenCache().indentState(startline, indenter)
+            if state:
+                indenter.thaw(state)
+                newtext = '\n'.join(indenter.lines(text))
+            else:
+                # the selection starts inside a multi-line string or comment,
+                # find out if the selected snippet is scheme code
+                tokenizer = self.doc.tokenCache().tokenizer(cursor)
+                startscheme = isinstance(tokenizer.parser(), tokenizer.SchemeParser)
+                newtext = self.doc.indent(text, startscheme = startscheme)
         else:
-            start = 0
             startline = 0
-            startscheme = False
             text = self.doc.text()
+            newtext = self.doc.indent(text, start = 0)
         
         # save the old indents
         ind = lambda line: re.compile(r'[^\S\n]*').match(line).group()
         oldindents = map(ind, text.splitlines())
-        text = self.doc.indent(text, start = start, startscheme = startscheme)
-        newindents = map(ind, text.splitlines())
+        newindents = map(ind, newtext.splitlines())
         
         # We don't just replace the text, because that would destroy smart
         # point and click. We only replace the indents.
@@ -484,9 +485,7 @@ class DocumentManipulator(object):
             menu.addAction(a)
         
         # run the parser to know more about the current context...
-        tokenizer = ly.tokenize.Tokenizer()
-        for token in tokenizer.tokens(self.doc.textToCursor(cursor)):
-            pass
+        tokenizer = self.doc.tokenCache().tokenizer(cursor)
         
         # Hyphenate Lyrics
         if selection and isinstance(tokenizer.parser(), tokenizer.LyricModeParser):
@@ -773,7 +772,8 @@ class DocumentManipulator(object):
         self.adjustCursorToChords()
         lastUsed = '\\arpeggioNormal'
         tokenizer = ly.tokenize.Tokenizer()
-        for token in tokenizer.tokens(self.doc.textToCursor()):
+        cache = self.doc.tokenCache()
+        for token in cache.tokens(tokenizer, 0, cache.position()):
             if (isinstance(token, tokenizer.Command)
                     and token in self._arpeggioTypes.values()):
                 lastUsed = token
@@ -849,9 +849,7 @@ class DocumentManipulator(object):
         with self.doc.editContext():
             atStart = cursor.position() == selRange.start().position()
             # Determine current depth (we could be in a long \book block)
-            tokenizer = ly.tokenize.Tokenizer()
-            for token in tokenizer.tokens(self.doc.textToCursor(selRange.start())):
-                pass
+            tokenizer = self.doc.tokenCache().tokenizer(selRange.start())
             self.doc.doc.removeText(selRange)
             insert = KTextEditor.Cursor(0, 0)
             for r in reversed(list(self.findBlankLines(tokenizer.depth()))):
@@ -885,9 +883,7 @@ class DocumentManipulator(object):
         with self.doc.editContext():
             atStart = cursor.position() == selRange.start().position()
             # Determine current depth (we could be in a long \book block)
-            tokenizer = ly.tokenize.Tokenizer()
-            for token in tokenizer.tokens(self.doc.textToCursor(selRange.start())):
-                pass
+            tokenizer = self.doc.tokenCache().tokenizer(selRange.start())
             self.doc.doc.removeText(selRange)
             for r in self.findBlankLines(tokenizer.depth()):
                 if r.start().position() > selRange.start().position():
@@ -910,20 +906,36 @@ class DocumentManipulator(object):
         else:
             self.doc.view.setCursorPosition(selRange.end())
 
+    def selectionTokenizer(self, tokenizer, start):
+        """
+        Puts the tokenizer in the state it has at the start of the selection,
+        using the token cache, and returns it, so the ly.tools functions do
+        not need to tokenize the text before the selection.
+        Returns None if start is 0 (i.e. there is no selection).
+        """
+        if start:
+            cursor = self.doc.view.selectionRange().start()
+            tokenizer.thaw(self.doc.tokenCache().tokenizer(cursor).freeze())
+            return tokenizer
+
     def convertRelativeToAbsolute(self):
         """
         Convert \relative { }  music to absolute pitches.
         """
         text, start = self.doc.selectionOrDocument()
-        ly.tools.relativeToAbsolute(text, start).applyToCursor(EditCursor(self.doc.doc))
+        tokenizer = self.selectionTokenizer(ly.tokenize.MusicTokenizer(), start)
+        ly.tools.relativeToAbsolute(text, start, tokenizer=tokenizer).applyToCursor(
+            EditCursor(self.doc.doc))
     
     def convertAbsoluteToRelative(self):
         """
         Converts the selected music expression or all toplevel expressions to \relative ones.
         """
         text, start = self.doc.selectionOrDocument()
+        tokenizer = self.selectionTokenizer(ly.tokenize.MusicTokenizer(), start)
         try:
-            ly.tools.absoluteToRelative(text, start).applyToCursor(EditCursor(self.doc.doc))
+            ly.tools.absoluteToRelative(text, start, tokenizer=tokenizer).applyToCursor(
+                EditCursor(self.doc.doc))
         except ly.NoMusicExpressionFound:
             KMessageBox.error(self.doc.app.mainwin, i18n(
                 "Please select a music expression, enclosed in << ... >> or { ... }."))
@@ -950,8 +962,10 @@ class DocumentManipulator(object):
                 "Please make sure you use pitch names in the language \"%1\".",
                 language))
             return
+        tokenizer = self.selectionTokenizer(ly.tokenize.MusicTokenizer(), start)
         try:
-            ly.tools.transpose(text, transposer, start).applyToCursor(EditCursor(self.doc.doc))
+            ly.tools.transpose(text, transposer, start, tokenizer=tokenizer).applyToCursor(
+                EditCursor(self.doc.doc))
         except ly.QuarterToneAlterationNotAvailable:
             KMessageBox.sorry(self.doc.app.mainwin, i18n(
                 "Can't perform the requested transposition.\n\n"
@@ -1065,13 +1079,16 @@ class RangeMixin(object):
     """
     def tokens(self, text, pos = 0, cursor = None):
         if cursor is None:
-            cursor = Cursor()
-        if pos:
-            cursor.walk(text[:pos])
-        start = cursor.kteCursor()
+            line, column = 0, 0
+        else:
+            line, column = cursor.line, cursor.column
+        lineIndex = ly.tokenize.LineIndex(text)
+        def kteCursor(pos):
+            l, c = lineIndex.position(pos)
+            return KTextEditor.Cursor(line + l, c + column if l == 0 else c)
+        start = kteCursor(pos)
         for token in super(RangeMixin, self).tokens(text, pos):
-            cursor.walk(token)
-            end = cursor.kteCursor()
+            end = kteCursor(token.end)
             token.range = KTextEditor.Range(start, end)
             start = end
             yield token
@@ -1082,22 +1099,153 @@ class RangeTokenizer(RangeMixin, ly.tokenize.Tokenizer):
     pass
 
 
-class RelativeTokenizer(ly.tokenize.Tokenizer):
+class TokenCache(object):
     """
-    A tokenizer to quickly check if we are in relative mode.
+    Keeps the tokenizer states of a Document at regular checkpoints, so that
+    all features needing parse context share the same tokenizing work.
+
+    The cache follows the edits in the KTextEditor document, and invalidates
+    only the checkpoints after the first changed line. See
+    ly.tokenize.IncrementalTokenizer.
     """
-    class Relative(ly.tokenize.Tokenizer.Command):
-        rx = r"\\relative\b"
-        def __init__(self, matchObj, tokenizer):
-            tokenizer.enter(tokenizer.RelativeParser, self)
-    
-    class ToplevelParser(ly.tokenize.Tokenizer.ToplevelParser):
-        items = staticmethod(lambda cls: (cls.Relative,) +
-            ly.tokenize.Tokenizer.ToplevelParser.items(cls))
-            
-    class RelativeParser(ToplevelParser):
-        argcount = 2 # TODO: account for (deprecated) \relative without pitch
+    def __init__(self, doc):
+        self.doc = weakref.proxy(doc)
+        self._tokenizer = ly.tokenize.IncrementalTokenizer(
+            ly.tokenize.Tokenizer, doc.text())
+        self._dirty = None # (first changed line, number of unchanged lines at end)
+        self._lineStates = {} # line number -> state at the start of the line
+        self._indentStates = {} # indenter settings -> {line number: state}
+        QtCore.QObject.connect(doc.doc, QtCore.SIGNAL(
+            "textInserted(KTextEditor::Document*, const KTextEditor::Range&)"),
+            self.slotTextInserted)
+        QtCore.QObject.connect(doc.doc, QtCore.SIGNAL(
+            "textRemoved(KTextEditor::Document*, const KTextEditor::Range&)"),
+            self.slotTextRemoved)
+
+    def slotTextInserted(self, doc, textRange):
+        self.changed(textRange.start().line(), textRange.end().line())
+
+    def slotTextRemoved(self, doc, textRange):
+        self.changed(textRange.start().line(), textRange.start().line())
+
+    def changed(self, first, last):
+        """
+        Called when the lines first to last (in the current document) have
+        been changed. Nothing is tokenized until the cache is used again.
+        """
+        tail = self.doc.doc.lines() - 1 - last
+        for line in [l for l in self._lineStates if l > first]:
+            del self._lineStates[line]
+        for states in self._indentStates.values():
+            for line in [l for l in states if l > first]:
+                del states[line]
+        if self._dirty:
+            first = min(first, self._dirty[0])
+            tail = min(tail, self._dirty[1])
+        self._dirty = first, tail
+
+    def update(self):
+        """ Brings the cache up-to-date with the document text. """
+        if not self._dirty:
+            return
+        first, tail = self._dirty
+        self._dirty = None
+        old, new = self._tokenizer.text(), self.doc.text()
+        pos = cursorToPosition(first, 0, old)
+        oldend, newend = len(old), len(new)
+        for i in range(tail):
+            oldend = old.rfind('\n', 0, oldend)
+            newend = new.rfind('\n', 0, newend)
+        if (0 <= pos <= min(oldend, newend) and old[:pos] == new[:pos]
+            and old[oldend:] == new[newend:]):
+            self._tokenizer.replace(pos, oldend, new[pos:newend])
+        else:
+            self._tokenizer.setText(new)
+            self._lineStates.clear()
+            self._indentStates.clear()
+
+    def text(self):
+        """ Returns the document text the cache currently represents. """
+        self.update()
+        return self._tokenizer.text()
+
+    def position(self, cursor=None):
+        """
+        Returns the position in the text of the given KTextEditor.Cursor,
+        or of the current cursor position.
+        """
+        if cursor is None:
+            cursor = self.doc.view.cursorPosition()
+        text = self.text()
+        pos = cursorToPosition(cursor.line(), cursor.column(), text)
+        return len(text) if pos == -1 else pos
+
+    def tokens(self, tokenizer=None, pos=0, end=None):
+        """
+        Iterates over the tokens of the document, see
+        ly.tokenize.IncrementalTokenizer.tokens().
+        """
+        self.update()
+        return self._tokenizer.tokens(tokenizer, pos, end)
+
+    def tokenizer(self, cursor=None):
+        """
+        Returns a Tokenizer in the state it would have after tokenizing the
+        document up to the given or current cursor position.
+        """
+        return self._tokenizer.tokenizer(self.position(cursor))
+
+    def lineTokenizer(self, line):
+        """
+        Returns a Tokenizer in the state it has at the start of the given line.
         
+        The states are remembered until a line before the given line changes,
+        so that e.g. completion only needs to tokenize the current line.
+        """
+        try:
+            state = self._lineStates[line]
+        except KeyError:
+            text = self.text()
+            pos = cursorToPosition(line, 0, text)
+            state = self._tokenizer.state(len(text) if pos == -1 else pos)
+            self._lineStates[line] = state
+        tokenizer = ly.tokenize.Tokenizer()
+        tokenizer.thaw(state)
+        return tokenizer
+
+    def indentState(self, line, indenter):
+        """
+        Returns the state (see ly.indent.Indenter.freeze()) the indenter has
+        at the start of the given line when it indents the whole document,
+        or None if the line starts inside a multi-line string or comment.
+        
+        The indenter must be in its initial state; it is used to indent the
+        lines before the given line, starting at the nearest line a state is
+        known for. The states are remembered like those of lineTokenizer().
+        """
+        key = indenter.start, indenter.indentwidth, indenter.tabwidth
+        states = self._indentStates.setdefault(key, {})
+        if line in states:
+            return states[line]
+        text = self.text()
+        end = cursorToPosition(line, 0, text)
+        if end == -1:
+            return None
+        first = max([l for l in states if l < line and states[l]] or [0])
+        if first:
+            indenter.thaw(states[first])
+        for l in indenter.lines(text[cursorToPosition(first, 0, text):end], False):
+            pass
+        state = states[line] = not indenter.incomplete and indenter.freeze() or None
+        return state
+
+    def stats(self):
+        """
+        Returns a tuple (hits, misses): the number of requests that could
+        use the existing checkpoints and those that needed to tokenize more.
+        """
+        return self._tokenizer.hits, self._tokenizer.misses
+
 
 class EditCursor(ly.tokenize.Cursor):
     """
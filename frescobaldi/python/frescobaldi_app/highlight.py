@@ -28,7 +28,7 @@ from PyQt4.QtGui import QBrush, QFont, QTextCharFormat, QSyntaxHighlighter
 
 import ly.tokenize, ly.words
 
-_keywords = (
+_keywords = frozenset(
     ly.words.keywords + ly.words.musiccommands + ly.words.markupcommands +
     ly.words.markuplistcommands + ly.words.modes)
 
@@ -61,34 +61,67 @@ def formats():
 
 class LilyPondHighlighter(QSyntaxHighlighter):
     
+    # number of distinct states before unused block states are reclaimed
+    compactThreshold = 256
+    
     def __init__(self, document):
         QSyntaxHighlighter.__init__(self, document)
         self.formats = formats()
-        self.state = []
+        self._states = []   # block state -> frozen tokenizer state (or None)
+        self._ids = {}      # frozen tokenizer state -> block state
+        self._free = []     # reclaimed block states
+        self._compactAt = self.compactThreshold
 
     def highlightBlock(self, text):
+        text = unicode(text)
         tokenizer = ly.tokenize.Tokenizer()
         previous = self.previousBlockState()
-        if 0 <= previous < len(self.state):
-            tokenizer.thaw(self.state[previous])
-        for token in tokenizer.tokens(text):
-            if isinstance(token, tokenizer.Command):
-                format = token[1:] in _keywords and 'keyword' or 'command'
-            elif isinstance(token, tokenizer.String):
+        if 0 <= previous < len(self._states) and self._states[previous]:
+            tokenizer.thaw(self._states[previous])
+        for cls, start, end in tokenizer.spans(text):
+            if issubclass(cls, tokenizer.Command):
+                format = text[start+1:end] in _keywords and 'keyword' or 'command'
+            elif issubclass(cls, tokenizer.String):
                 format = 'string'
-            elif token in ('{', '}', '<<', '>>', '#{', '#}', '<', '>'):
+            elif end - start <= 2 and text[start:end] in (
+                    '{', '}', '<<', '>>', '#{', '#}', '<', '>'):
                 format = 'delimiter'
-            elif isinstance(token, tokenizer.Comment):
+            elif issubclass(cls, tokenizer.Comment):
                 format = 'comment'
-            elif isinstance(token, tokenizer.SchemeToken):
+            elif issubclass(cls, tokenizer.SchemeToken):
                 format = 'scheme'
             else:
                 continue
-            self.setFormat(token.pos, len(token), self.formats[format])
-        state = tokenizer.freeze()
+            self.setFormat(start, end - start, self.formats[format])
+        self.setCurrentBlockState(self.blockState(tokenizer.freeze()))
+
+    def blockState(self, state):
+        """Returns the block state number for the frozen tokenizer state."""
         try:
-            self.setCurrentBlockState(self.state.index(state))
-        except ValueError:
-            self.setCurrentBlockState(len(self.state))
-            self.state.append(state)
+            return self._ids[state]
+        except KeyError:
+            pass
+        if not self._free and len(self._states) >= self._compactAt:
+            self.compact()
+        if self._free:
+            num = self._free.pop()
+            self._states[num] = state
+        else:
+            num = len(self._states)
+            self._states.append(state)
+        self._ids[state] = num
+        return num
 
+    def compact(self):
+        """Reclaims the block states that are not used by any block anymore."""
+        used = set()
+        block = self.document().begin()
+        while block.isValid():
+            used.add(block.userState())
+            block = block.next()
+        for state, num in self._ids.items():
+            if num not in used:
+                del self._ids[state]
+                self._states[num] = None
+                self._free.append(num)
+        self._compactAt = max(self.compactThreshold, len(self._ids) * 2)
@@ -27,9 +27,11 @@ from glob import glob
 import ly.rx
 from hyphenator import Hyphenator
 
+from PyQt4.QtCore import QThread
 from PyQt4.QtGui import QLabel, QListWidget, QVBoxLayout
 from PyKDE4.kdecore import KConfig, KGlobal, i18n
 from PyKDE4.kdeui import KDialog, KMessageBox
+from PyKDE4.ktexteditor import KTextEditor
 
 try:
     language, encoding = locale.getdefaultlocale()
@@ -52,6 +54,9 @@ defaultPaths = [
 
 hyphdicts = {}
 
+# texts with more words than this are hyphenated in the background
+backgroundThreshold = 2000
+
 def config(group="hyphenation"):
     return KGlobal.config().group(group)
 
@@ -113,6 +118,10 @@ def hyphenate(text, mainwindow):
     Ask the user which language to use.
     Returns None if the user cancels the dialog or no hyphenation pattern files
     could be found.
+    
+    If the text contains more than backgroundThreshold words, it is hyphenated
+    in the background, and also None is returned. The selection is replaced
+    with the hyphenated text when ready.
     """
     if not hyphdicts:
         KMessageBox.sorry(mainwindow, i18n(
@@ -143,6 +152,60 @@ def hyphenate(text, mainwindow):
         lang = langs[listbox.currentRow()]
         conf.writeEntry("lastused", lang)
         conf.sync()
-        # get hyphenator
-        h = Hyphenator(hyphdicts[lang])
-        return ly.rx.lyric_word.sub(lambda m: h.inserted(m.group(), ' -- '), text)
+        # get hyphenator, keeping a compiled copy of the patterns in appdata
+        dic = hyphdicts[lang]
+        compiled = os.path.join(
+            KGlobal.dirs().saveLocation('appdata', 'hyphdicts/'),
+            os.path.splitext(os.path.basename(dic))[0] + '.compiled')
+        h = Hyphenator(dic, compiled=compiled)
+        if len(ly.rx.lyric_word.findall(text)) > backgroundThreshold:
+            BackgroundHyphenator(mainwindow.currentDocument(), text, h).start()
+        else:
+            return insertHyphens(text, h)
+
+
+def insertHyphens(text, hyphenator):
+    """Returns the text with ' -- ' inserted in all words.
+    
+    Every distinct word is hyphenated only once.
+    
+    """
+    words = iter(hyphenator.batch(ly.rx.lyric_word.findall(text), ' -- '))
+    return ly.rx.lyric_word.sub(lambda m: next(words), text)
+
+
+class BackgroundHyphenator(QThread):
+    """Hyphenates the selected text of a document in a background thread.
+    
+    When ready, the selected range is replaced with the hyphenated text, but
+    only if the text in that range has not been changed in the meantime.
+    
+    """
+    # keep references to running instances
+    _running = set()
+    
+    def __init__(self, doc, text, hyphenator):
+        QThread.__init__(self)
+        self.doc = doc
+        self.range = KTextEditor.Range(doc.view.selectionRange())
+        self.text = text
+        self.hyphenator = hyphenator
+        self.result = None
+        self.finished.connect(self.apply)
+        self._running.add(self)
+    
+    def run(self):
+        self.result = insertHyphens(self.text, self.hyphenator)
+    
+    def apply(self):
+        self._running.discard(self)
+        doc = self.doc
+        if self.result is None or doc not in doc.app.documents:
+            return
+        if unicode(doc.doc.text(self.range)) != self.text:
+            KMessageBox.sorry(doc.app.mainwin, i18n(
+                "The text to hyphenate has been changed in the meantime, "
+                "so the hyphenation has not been applied."))
+            return
+        with doc.editContext():
+            doc.doc.replaceText(self.range, self.result)
@@ -19,10 +19,10 @@
 
 from __future__ import unicode_literals
 
-import os, re, sip, weakref
+import os, re, sip, time, weakref
 from dbus.service import method
 
-from PyQt4.QtCore import QDir, QEvent, QSize, QTimer, Qt
+from PyQt4.QtCore import QDir, QEvent, QFileSystemWatcher, QSize, QTimer, Qt
 from PyQt4.QtGui import (
     QActionGroup, QColor, QIcon, QLabel, QPalette, QPixmap, QProgressBar,
     QStackedWidget, QWidget)
@@ -34,6 +34,7 @@ from PyKDE4.kparts import KParts
 from PyKDE4.ktexteditor import KTextEditor
 
 from signals import Signal
+import jobqueue
 
 import kateshell.app, kateshell.mainwindow
 from kateshell.app import cacheresult
@@ -60,6 +61,16 @@ class MainApp(kateshell.app.MainApp):
         # make files for stylesheets and LilyPond-generated pics easily found:
         QDir.setSearchPaths('css', KGlobal.dirs().findDirs('appdata', 'css/'))
         QDir.setSearchPaths('pics', KGlobal.dirs().findDirs('appdata', 'pics/'))
+        # load the information about the LilyPond instances from the last
+        # session, and update it in the background if LilyPond has changed.
+        import ly.version
+        ly.version.probeCache = ly.version.ProbeCache(os.path.join(
+            KGlobal.dirs().saveLocation('appdata'), 'lilypondinfo'))
+        ly.version.probe(
+            config("lilypond").readEntry("paths", ["lilypond"]) or ["lilypond"],
+            wait=False)
+        import ly.font
+        ly.font.indexDirectory = KGlobal.dirs().saveLocation('appdata', 'fonts/')
     
     def setupConfiguration(self, config):
         # If the application got upgraded, run the install module
@@ -132,6 +143,28 @@ class MainApp(kateshell.app.MainApp):
     
     def keepMetaInfo(self):
         return config().readEntry("save metainfo", False)
+    
+    @cacheresult
+    def includeGraph(self):
+        """Returns the ly.parse.IncludeGraph, saved between sessions."""
+        import ly.parse
+        return ly.parse.IncludeGraph(os.path.join(
+            KGlobal.dirs().saveLocation('appdata'), 'includegraph'))
+
+    def buildCache(self):
+        """Returns the ly.buildcache.BuildCache, or None if it is disabled."""
+        size = config("preferences").readEntry("build cache size", 100)
+        if size:
+            cache = self._buildCache()
+            cache.maxSize = size * 1024 * 1024
+            return cache
+    
+    @cacheresult
+    def _buildCache(self):
+        import ly.buildcache
+        return ly.buildcache.BuildCache(
+            KGlobal.dirs().saveLocation('cache', 'frescobaldi/build/'),
+            includeGraph=self.includeGraph())
 
 
 class Document(kateshell.app.Document):
@@ -149,7 +182,28 @@ class Document(kateshell.app.Document):
         super(Document, self).__init__(*args, **kwargs)
         self.resetLocalFileManager()
         self.urlChanged.connect(self.resetLocalFileManager)
+        self.saved.connect(self.outputsChanged)
 
+    def outputsChanged(self):
+        """Forgets the modification times of our file and its outputs.
+        
+        Also the directories of the %%master files and of the local file
+        manager are forgotten, as LilyPond writes the output there.
+        
+        """
+        paths = []
+        if self.localFileManager():
+            paths.append(self.localFileManager().path())
+        path = self.localPath()
+        if path:
+            paths.append(path)
+            lvars = self.variables()
+            for var in 'master', 'master-preview', 'master-publish':
+                if var in lvars:
+                    paths.append(os.path.join(os.path.dirname(path), lvars[var]))
+        for directory in set(os.path.dirname(p) for p in paths):
+            outputIndex.invalidate(directory)
+    
     def documentIcon(self):
         if self.app.mainwin.jobManager().job(self):
             return "run-lilypond"
@@ -240,6 +294,17 @@ class Document(kateshell.app.Document):
         import frescobaldi_app.document
         return frescobaldi_app.document.DocumentManipulator(self)
 
+    @cacheresult
+    def tokenCache(self):
+        """Returns a singleton object for this document that keeps tokenizer
+        states, shared by all features that need to know the parse context.
+        
+        Only use this when the document has materialized.
+        
+        """
+        import frescobaldi_app.document
+        return frescobaldi_app.document.TokenCache(self)
+
     def currentIndent(self, cursor=None, checkColumn=True):
         """Returns the indent of the line the given cursor is on, or of the
         current line.
@@ -267,6 +332,17 @@ class Document(kateshell.app.Document):
             startscheme = startscheme,
             )
 
+    def indenter(self):
+        """Returns a ly.indent.Indenter using the settings of this document,
+        to indent the document (or a part of it) from the first line."""
+        import ly.indent
+        return ly.indent.Indenter(
+            start = 0,
+            indentwidth = self.indentationWidth(),
+            tabwidth = self.tabWidth(),
+            usetabs = not self.indentationSpaces(),
+            )
+
     def needsLocalFileManager(self):
         return self.url().isEmpty() or self.url().protocol() != "file"
         
@@ -421,10 +497,12 @@ class MainWindow(SymbolManager, kateshell.mainwindow.MainWindow):
     @cacheresult
     def jobManager(self):
         man = JobManager()
-        man.jobStarted.connect(self.updateJobActions)
-        man.jobFinished.connect(self.updateJobActions)
-        man.jobStarted.connect(self.setTabIcons)
-        man.jobFinished.connect(self.setTabIcons)
+        for signal in (man.jobQueued, man.jobStarted, man.jobFinished,
+                       man.jobCancelled):
+            signal.connect(self.updateJobActions)
+            signal.connect(self.setTabIcons)
+        self.app.documentClosed.connect(man.documentClosed)
+        self.settingsChanged.connect(lambda: man.setMaxJobs(maxJobs()))
         return man
     
     @cacheresult
@@ -466,7 +544,10 @@ class MainWindow(SymbolManager, kateshell.mainwindow.MainWindow):
                     self.runLilyPond("custom")
                 else:
                     job = self.jobManager().job(d)
-                    job.abort() if job else self.runLilyPond("preview")
+                    if job:
+                        self.jobManager().cancel(job)
+                    else:
+                        self.runLilyPond("preview")
 
         # Score wizard
         @self.onAction(i18n("Setup New Score..."), "text-x-lilypond",
@@ -496,7 +577,7 @@ class MainWindow(SymbolManager, kateshell.mainwindow.MainWindow):
             if d:
                 job = self.jobManager().job(d)
                 if job:
-                    job.abort()
+                    self.jobManager().cancel(job)
         
         # File menu actions:
         @self.onAction(i18n("Print Music..."), "document-print",
@@ -845,7 +926,10 @@ class MainWindow(SymbolManager, kateshell.mainwindow.MainWindow):
         
         # create a Job
         import frescobaldi_app.runlily
-        job = frescobaldi_app.runlily.DocumentJob(d)
+        if config("preferences").readEntry("incremental build", False):
+            job = frescobaldi_app.runlily.IncrementalDocumentJob(d)
+        else:
+            job = frescobaldi_app.runlily.DocumentJob(d)
         
         # configure this Job
         job.preview = False
@@ -867,7 +951,7 @@ class MainWindow(SymbolManager, kateshell.mainwindow.MainWindow):
         # custom dialog can be requested even when there is a job running.
         if self.jobManager().job(d):
             return KMessageBox.sorry(self, i18n(
-                "There is already a LilyPond job running "
+                "There is already a LilyPond job running or waiting "
                 "for this document."), i18n("Can't process document"))
         
         # check if the user has a forced point and click setting in the file
@@ -890,10 +974,9 @@ class MainWindow(SymbolManager, kateshell.mainwindow.MainWindow):
                     "turn point and click on.")))):
                     # cancelled
                     # put the cursor at the point and click command
-                    import frescobaldi_app.document
-                    cursor = frescobaldi_app.document.Cursor()
-                    cursor.walk(text[:m.start()])
-                    d.view.setCursorPosition(cursor.kteCursor())
+                    import ly.tokenize
+                    line, column = ly.tokenize.LineIndex(text).position(m.start())
+                    d.view.setCursorPosition(KTextEditor.Cursor(line, column))
                     return
                     
         # init the progress bar (only done once)
@@ -941,6 +1024,7 @@ class MainWindow(SymbolManager, kateshell.mainwindow.MainWindow):
         
     def saveSettings(self):
         self.app.stateManager().cleanup()
+        self.app.includeGraph().save()
         super(MainWindow, self).saveSettings()
 
     def notifyCompileFinished(self, job, success):
@@ -1338,54 +1422,64 @@ class LilyDocTool(kateshell.mainwindow.Tool):
         self.show()
 
 
-class JobManager(object):
-    """Manages running LilyPond jobs.
+class JobManager(jobqueue.JobQueue):
+    """Manages running and waiting LilyPond jobs.
     
-    Emits:
+    At most one job per document can be running or waiting at a time. Preview
+    jobs are started before publish jobs. The maximum number of jobs running
+    at the same time is read from the "max lilypond jobs" setting (default:
+    the number of processors).
+    
+    Emits (see jobqueue.JobQueue):
+    jobQueued(job)
     jobStarted(job)
     jobFinished(job, success)
+    jobCancelled(job)
     
     """
-    jobStarted = Signal()
-    jobFinished = Signal()
-    
     def __init__(self):
+        super(JobManager, self).__init__(maxJobs())
         self.jobs = {}
         
     def job(self, doc):
-        """Returns the job running for the given document.
+        """Returns the job running or waiting for the given document.
         
-        Returns None if no job is running.
+        Returns None if there is no job for the document.
         
         """
         return self.jobs.get(doc)
     
-    def count(self):
-        """Returns the number of running jobs."""
-        return len(self.jobs)
-        
     def docs(self):
-        """Returns a list of documents that have a LilyPond job running."""
+        """Returns a list of documents that have a LilyPond job."""
         return self.jobs.keys()
     
     def run(self, job):
         """Runs a job.
         
-        Adds the job to the list of running jobs, emits the jobStarted() signal,
-        and calls the job.start() method. The jobFinished() signal is emitted
-        when the job has finished.
+        Adds the job to the queue and emits the jobQueued() signal. The
+        jobStarted() signal is emitted (and the job.start() method called) as
+        soon as there is room for the job, the jobFinished() signal when the
+        job has finished.
         
         """
         if job.document in self.jobs:
             return
         self.jobs[job.document] = job
-        job.done.connect(self._finished)
-        self.jobStarted(job)
-        job.start()
+        self.add(job, 0 if job.preview else 1)
+    
+    def documentClosed(self, doc):
+        """Removes a waiting job for a document that is closed."""
+        job = self.jobs.get(doc)
+        if job and job not in self._running:
+            self.cancel(job)
     
     def _finished(self, success, job):
         del self.jobs[job.document]
-        self.jobFinished(job, success)
+        super(JobManager, self)._finished(success, job)
+    
+    def _cancelled(self, job):
+        del self.jobs[job.document]
+        super(JobManager, self)._cancelled(job)
 
 
 class CompletionModel(KTextEditor.CodeCompletionModel):
@@ -1393,13 +1487,29 @@ class CompletionModel(KTextEditor.CodeCompletionModel):
         KTextEditor.CodeCompletionModel.__init__(self, doc.view)
         self.doc = weakref.proxy(doc)
         self.result = None
+        self.invocations = 0
+        self.lastLatency = 0.0
+        self.totalLatency = 0.0
         
     def completionInvoked(self, view, word, invocationType):
         import frescobaldi_app.completion
+        start = time.time()
         self.result = frescobaldi_app.completion.getCompletions(
             self, view, word, invocationType)
+        self.lastLatency = time.time() - start
+        self.totalLatency += self.lastLatency
+        self.invocations += 1
         self.reset()
     
+    def latency(self):
+        """
+        Returns a tuple (invocations, last, average): the number of times
+        completion was invoked, and the seconds the last and an average
+        invocation needed to determine the completions.
+        """
+        average = self.invocations and self.totalLatency / self.invocations
+        return self.invocations, self.lastLatency, average
+    
     def index(self, row, column, parent):
         return self.result.index(row, column, parent)
         
@@ -1469,6 +1579,11 @@ class SessionManager(kateshell.mainwindow.SessionManager):
 
 
 # Easily get our global config
+def maxJobs():
+    """Returns the maximum number of LilyPond jobs to run at the same time."""
+    return (config("preferences").readEntry("max lilypond jobs", 0)
+            or jobqueue.cpuCount())
+
 def config(group="preferences"):
     return KGlobal.config().group(group)
     
@@ -1516,8 +1631,7 @@ def automaticLilyPondCommand(version):
     
     # get all versions
     import ly.version
-    ver = dict((path, ly.version.LilyPondInstance(path).version())
-        for path in paths)
+    ver = ly.version.versions(paths)
 
     # sort on version
     paths.sort(key=ver.get)
@@ -1537,21 +1651,18 @@ def updatedFiles(lyfile, reftime=None):
     
     """
     import fnmatch
-    if lyfile and os.path.exists(lyfile):
+    files = lyfile and outputIndex.files(lyfile)
+    if files:
+        mtime, outputs = files
         if reftime is None:
-            reftime = os.path.getmtime(lyfile)
+            reftime = mtime
         directory, name = os.path.split(lyfile)
         escname = re.escape(os.path.splitext(name)[0]) # remove ext, escape
         def generatorfunc(ext = "*"):
             ext = fnmatch.translate(ext.lstrip('.'))
             pat = re.compile(r'{0}(-[^-]+)*\.{1}'.format(escname, ext))
-            try:
-                files = [f for f in os.listdir(directory) if pat.match(f)]
-            except OSError:
-                return []
-            files.sort(key=filenamekey)
-            files = [os.path.join(directory, f) for f in files]
-            return [f for f in files if os.path.getmtime(f) >= reftime]
+            return [os.path.join(directory, f) for f, t in outputs
+                    if t >= reftime and pat.match(f)]
     else:
         def generatorfunc(ext=None):
             return []
@@ -1559,6 +1670,93 @@ def updatedFiles(lyfile, reftime=None):
     return generatorfunc
     
 
+class OutputIndex(object):
+    """Keeps the names and modification times of LilyPond output files.
+    
+    A directory is listed once, and for every document in it, the files named
+    after the document are looked up once. The directories are watched, and
+    forgotten when a file is added, removed or renamed. The files of a
+    document are looked up again when its modification time changed. Call
+    invalidate() when files are known to be changed otherwise, e.g. when a
+    LilyPond job has finished.
+    
+    At most maxDirectories directories are kept.
+    
+    """
+    maxDirectories = 50
+    
+    def __init__(self):
+        self._dirs = {}     # directory -> (names, {name: files})
+        self._order = []    # the directories, least recently used first
+        self._watcher = None
+    
+    def files(self, lyfile):
+        """Returns (mtime, outputs) for lyfile, or None if it does not exist.
+        
+        outputs is a list of (name, mtime) tuples of the files in the same
+        directory that are named after lyfile (including lyfile itself), in
+        natural sort order.
+        
+        """
+        directory, name = os.path.split(os.path.abspath(lyfile))
+        try:
+            names, bases = self._dirs[directory]
+        except KeyError:
+            try:
+                names = frozenset(os.listdir(directory))
+            except OSError:
+                return None
+            bases = {}
+            self._add(directory, (names, bases))
+        else:
+            # mark as recently used
+            self._order.remove(directory)
+            self._order.append(directory)
+        if name not in names:
+            return None
+        try:
+            mtime = os.path.getmtime(lyfile)
+        except OSError:
+            return None
+        result = bases.get(name)
+        if result and result[0] == mtime:
+            return result
+        base = os.path.splitext(name)[0]
+        pat = re.compile(r'{0}(-[^-]+)*\.'.format(re.escape(base)))
+        outputs = []
+        for f in sorted((f for f in names if pat.match(f)), key=filenamekey):
+            try:
+                outputs.append((f, os.path.getmtime(os.path.join(directory, f))))
+            except OSError:
+                pass
+        result = bases[name] = (mtime, outputs)
+        return result
+    
+    def _add(self, directory, entry):
+        if self._watcher is None:
+            self._watcher = QFileSystemWatcher()
+            self._watcher.directoryChanged.connect(self.invalidate)
+        while len(self._order) >= self.maxDirectories:
+            old = self._order.pop(0)
+            del self._dirs[old]
+            self._watcher.removePath(old)
+        self._dirs[directory] = entry
+        self._order.append(directory)
+        self._watcher.addPath(directory)
+    
+    def invalidate(self, directory):
+        """Forgets the files in directory."""
+        directory = os.path.abspath(directory)
+        if self._dirs.pop(directory, None):
+            self._order.remove(directory)
+            if self._watcher:
+                self._watcher.removePath(directory)
+
+
+# the OutputIndex used by updatedFiles()
+outputIndex = OutputIndex()
+
+
 # is string an empty or blank line?
 def isblank(text):
     """True if text is empty or whitespace-only."""
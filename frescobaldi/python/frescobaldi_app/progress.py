@@ -25,6 +25,7 @@ the Frescobaldi main window
 """
 
 from PyQt4.QtCore import QTimer
+from PyKDE4.kdecore import i18np
 
 _ticks = 10     # ticks per second
 
@@ -43,6 +44,9 @@ class ProgressBarManager(object):
         self.hideTimer.timeout.connect(self.bar.hide)
         self.man.jobStarted.connect(self.start)
         self.man.jobFinished.connect(self.stop)
+        for signal in (self.man.jobQueued, self.man.jobStarted,
+                       self.man.jobFinished, self.man.jobCancelled):
+            signal.connect(self.updateFormat)
         
     def start(self, job):
         """ Call this when a job has started. """
@@ -61,7 +65,7 @@ class ProgressBarManager(object):
                 
     def stop(self, job, success):
         """ Call this when a job has stopped. """
-        if success:
+        if success and not job.cached:
             job.document.metainfo["build time"] = job.buildTime
         
         if self.man.count() == 0:
@@ -74,5 +78,12 @@ class ProgressBarManager(object):
                 
     def timeout(self):
         self.bar.setValue(self.bar.value() + 1)
-        
 
+    def updateFormat(self):
+        """ Shows the number of waiting jobs in the progress bar. """
+        count = self.man.queueCount()
+        if count:
+            self.bar.setFormat(i18np("%p% (1 job waiting)",
+                "%p% (%1 jobs waiting)", count))
+        else:
+            self.bar.setFormat("%p%")
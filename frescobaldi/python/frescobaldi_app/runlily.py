@@ -21,8 +21,9 @@ from __future__ import unicode_literals
 
 """ Code to run LilyPond and display its output in a LogWidget """
 
-import math, os, re, shutil, sys, tempfile, time
-from itertools import count, repeat
+import hashlib, math, os, shutil, sys, tempfile, time
+from collections import deque
+from itertools import count
 
 from PyQt4.QtCore import QProcess, QSize, QTimer, QUrl, Qt
 from PyQt4.QtGui import (
@@ -35,19 +36,18 @@ from PyKDE4.kdeui import (
 from PyKDE4.kio import KEncodingFileDialog
 
 from signals import Signal, SignalProxy
+from jobqueue import commandLine
 
 from kateshell.app import resolvetabs_text
 from frescobaldi_app.actions import openPDF
 from frescobaldi_app.mainapp import (
-    automaticLilyPondCommand, lilyPondCommand, lilyPondVersion, updatedFiles)
+    automaticLilyPondCommand, lilyPondCommand, lilyPondVersion, outputIndex,
+    updatedFiles)
 
 
 def config(group):
     return KGlobal.config().group(group)
 
-# to find filenames with line:col pairs in LilyPond output
-_ly_message_re = re.compile(r"^((.*?):(\d+)(?::(\d+))?)(?=:)", re.M)
-
 
 class BasicLilyPondJob(object):
     """
@@ -57,6 +57,9 @@ class BasicLilyPondJob(object):
     The Signal done(success, self) is emitted when the job has finished.
     The SignalProxy output(msg, type, newline=False) is emitted when there is output
     (stderr and stdout).  This proxy is called like Log and LogWidget.
+    The Signal diagnostic(diagnostic, self) is emitted for every error or
+    warning LilyPond prints (a ly.diagnostics.Diagnostic), which are also
+    collected in the diagnostics list.
     Don't use (Basic)LilyPondJob for more than one run.
     """
     
@@ -74,8 +77,12 @@ class BasicLilyPondJob(object):
     startTime = 0.0             # time.time() this job started
     buildTime = 0.0             # time in seconds this job has been running
     
+    buildCache = None           # ly.buildcache.BuildCache to use, if any
+    cached = False              # True if the output came from the buildCache
+    
     done = Signal(fireOnce=True)
     output = SignalProxy()
+    diagnostic = Signal()
     
     def __init__(self):
         pass
@@ -84,17 +91,29 @@ class BasicLilyPondJob(object):
         """ Starts the process. """
         # save some values
         self._directory, self._basename = os.path.split(self.lyfile)
+        self._startOutput()
         
         # construct the full LilyPond command.
-        cmd = [self.command]
-        self.verbose and cmd.append("--verbose")
-        cmd.append("-dpoint-and-click=" + scmbool(self.preview))
-        cmd.append("-ddelete-intermediate-files=" + scmbool(self.delfiles))
-        for path in self.include:
-            cmd.append("--include")
-            cmd.append(path)
-        cmd.extend(self.arguments)
-        cmd.append(self._basename)
+        cmd = self._command = commandLine(self.lyfile, self.command,
+            self.arguments, self.include, self.preview, self.verbose,
+            self.delfiles)
+        version = lilyPondVersion(self.command)
+        
+        # if nothing changed since an earlier run, use its output files
+        self._p = None
+        self._cacheKey = None
+        if self.buildCache:
+            self._cacheKey = self.buildCache.key(self.lyfile, cmd, version,
+                self.include)
+            self.startTime = time.time()
+            if self._cacheKey and self.buildCache.restore(self._cacheKey,
+                                                          self._directory):
+                self.cached = True
+                self.output.writeMsg(i18n("LilyPond [%1] is up to date, "
+                    "using the output of an earlier run.", self._basename),
+                    "msgok")
+                QTimer.singleShot(0, lambda: self._exit(True))
+                return
         
         # create KProcess instance that does the work
         p = self._p = KProcess()
@@ -106,7 +125,6 @@ class BasicLilyPondJob(object):
         p.readyRead.connect(self._readOutput)
         
         mode = i18n("preview mode") if self.preview else i18n("publish mode")
-        version = lilyPondVersion(self.command)
         if version:
             self.output.writeLine(i18n("LilyPond %1 [%2] starting (%3)...",
                 format(version), self._basename, mode))
@@ -124,11 +142,16 @@ class BasicLilyPondJob(object):
         
         """
         self.buildTime = time.time() - self.startTime
+        outputIndex.invalidate(self._directory)
+        if self.buildCache:
+            # keep the include graph the cache key was computed with
+            self.buildCache.includeGraph.save()
         self.done(success, self)
         
     def abort(self):
         """ Abort the LilyPond job """
-        self._p.terminate()
+        if self._p:
+            self._p.terminate()
 
     def kill(self):
         """ Immediately kill the job, and disconnect it's output signals, etc.
@@ -136,6 +159,8 @@ class BasicLilyPondJob(object):
         Will exit the job with success = False.
         
         """
+        if not self._p:
+            return
         self._p.finished.disconnect(self._finished)
         self._p.error.disconnect(self._error)
         self._p.readyRead.disconnect(self._readOutput)
@@ -144,6 +169,7 @@ class BasicLilyPondJob(object):
         self._exit(False)
         
     def _finished(self, exitCode, exitStatus):
+        self._writeOutput(self._parser.flush())
         if exitCode:
             self.output.writeMsg(i18n("LilyPond [%1] exited with return code %2.",
                 self._basename, exitCode), "msgerr")
@@ -156,10 +182,22 @@ class BasicLilyPondJob(object):
             f = "{0:.0f}'{1:.0f}\"" if minutes else '{1:.1f}"'
             self.output.writeMsg(i18n("LilyPond [%1] finished (%2).",
                 self._basename, f.format(minutes, seconds)), "msgok")
+            self._storeOutput()
         
         # otherwise we delete ourselves during our event handler, causing crash
         QTimer.singleShot(0, lambda: self._exit(not (exitCode or exitStatus)))
     
+    def _storeOutput(self):
+        """ Stores the output files in the buildCache. """
+        # don't store if an input file was changed while LilyPond was running
+        if self._cacheKey and self._cacheKey == self.buildCache.key(
+                self.lyfile, self._command, lilyPondVersion(self.command),
+                self.include):
+            import ly.buildcache
+            self.buildCache.store(self._cacheKey, ly.buildcache.outputFiles(
+                self.lyfile, math.floor(self.startTime),
+                self.buildCache.includeGraph.find(self.lyfile, self.include)))
+    
     def _error(self, errCode):
         """ Called when QProcess encounters an error """
         if errCode == QProcess.FailedToStart:
@@ -175,19 +213,29 @@ class BasicLilyPondJob(object):
             # otherwise we delete ourselves during our event handler, causing crash
             QTimer.singleShot(0, lambda: self._exit(False))
         
-    def _readOutput(self):
+    def _startOutput(self):
+        """ Prepares reading the output of a new process. """
+        import codecs, ly.diagnostics
+        self.diagnostics = []
         encoding = sys.getfilesystemencoding() or 'utf-8'
-        text = str(self._p.readAllStandardOutput()).decode(encoding, 'replace')
-        parts = iter(_ly_message_re.split(text))
-        # parts has an odd length(1, 6, 11 etc)
-        # message, <url, path, line, col, message> etc.
-        self.output.write(next(parts))
-        for url, path, line, col, msg in zip(*repeat(parts, 5)):
-            path = os.path.join(self._directory, path)
-            line = int(line or "1") or 1
-            col = int(col or "0")
-            self.output.writeFileRef(url, path, line, col)
-            self.output.write(msg)
+        self._decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self._parser = ly.diagnostics.Parser(self._directory,
+            self._addDiagnostic)
+    
+    def _addDiagnostic(self, diagnostic):
+        self.diagnostics.append(diagnostic)
+        self.diagnostic(diagnostic, self)
+    
+    def _readOutput(self):
+        text = self._decoder.decode(str(self._p.readAllStandardOutput()))
+        self._writeOutput(self._parser.feed(text))
+    
+    def _writeOutput(self, pieces):
+        for text, ref in pieces:
+            if ref:
+                self.output.writeFileRef(text, *ref)
+            else:
+                self.output.write(text)
     
     def updatedFiles(self):
         """
@@ -219,22 +267,156 @@ class DocumentJob(LilyPondJob):
     def __init__(self, doc=None):
         self.document = doc
         super(DocumentJob, self).__init__()
+        if doc:
+            self.buildCache = doc.app.buildCache()
         
     def start(self):
+        self.lyfile = self.masterFile()
+        self.document.closed.connect(self.kill)
+        super(DocumentJob, self).start()
+
+    def masterFile(self):
+        """ Returns the file LilyPond should be run on. """
         if self.document.needsLocalFileManager():
             # handle nonlocal or unnamed documents
-            lyfile = self.document.localFileManager(True).makeLocalFile()
-        else:
-            # look for %%master directives
-            lyfile = self.document.localPath()
-            lvars = self.document.variables()
-            ly = (lvars.get(self.preview and 'master-preview' or 'master-publish')
-                  or lvars.get('master'))
-            if ly:
-                lyfile = os.path.join(os.path.dirname(lyfile), ly)
+            return self.document.localFileManager(True).makeLocalFile()
+        # look for %%master directives
+        lyfile = self.document.localPath()
+        lvars = self.document.variables()
+        ly = (lvars.get(self.preview and 'master-preview' or 'master-publish')
+              or lvars.get('master'))
+        if ly:
+            lyfile = os.path.join(os.path.dirname(lyfile), ly)
+        return lyfile
+
+
+class IncrementalDocumentJob(DocumentJob):
+    """
+    A DocumentJob that compiles every toplevel \score or \bookpart
+    separately (see ly.units), and only the ones that changed since the
+    previous run. Then the PDF files are combined.
+    
+    If the document can't be split, or the build cache is disabled (so the
+    parts that did not change can't be skipped), LilyPond is run on the
+    whole document.
+    """
+    _build = None
+    _job = None
+    
+    def start(self):
+        if not self.buildCache:
+            return super(IncrementalDocumentJob, self).start()
+        import ly.units
+        lyfile = self.masterFile()
+        try:
+            build = ly.units.Build(lyfile, self.unitDirectory(lyfile))
+        except (IOError, UnicodeError):
+            build = None
+        if not build or not build.units or len(build.units) < 2:
+            self.output.writeLine(i18n("The document can't be compiled in "
+                "parts, running LilyPond on the whole document."))
+            return super(IncrementalDocumentJob, self).start()
         self.lyfile = lyfile
+        self._directory, self._basename = os.path.split(lyfile)
+        self._build = build
+        self._p = None
+        self._startOutput()
         self.document.closed.connect(self.kill)
-        super(DocumentJob, self).start()
+        self.startTime = time.time()
+        self._startUnit(0)
+    
+    @staticmethod
+    def unitDirectory(lyfile):
+        """ Returns the directory to keep the units of lyfile in. """
+        import hashlib
+        name = hashlib.sha1(os.path.abspath(lyfile).encode('utf-8')).hexdigest()
+        return KGlobal.dirs().saveLocation('cache', 'frescobaldi/units/' + name)
+    
+    def _startUnit(self, index):
+        self._index = index
+        job = self._job = BasicLilyPondJob()
+        for attr in ('command', 'arguments', 'preview', 'verbose', 'delfiles',
+                     'buildCache'):
+            setattr(job, attr, getattr(self, attr))
+        job.include = self.include + [self._directory]
+        job.lyfile = self._build.write(index)
+        job.output.connect(self.output)
+        job.diagnostic.connect(self._addDiagnostic)
+        job.done.connect(self._unitDone)
+        job.start()
+    
+    def _unitDone(self, success, job):
+        self._job = None
+        if not success:
+            return self._exit(False)
+        pagesKnown = self._build.finished(self._index, not job.cached)
+        if self._index + 1 < len(self._build.units):
+            if not pagesKnown:
+                self.output.writeLine(i18n("Could not count the pages of "
+                    "part %1, running LilyPond on the whole document.",
+                    self._index + 1))
+                self._build = None
+                return LilyPondJob.start(self)
+            return self._startUnit(self._index + 1)
+        rebuilt = self._build.rebuilt
+        self.cached = not rebuilt
+        self.output.writeMsg(i18n("Compiled %1 of %2 parts (%3).",
+            len(rebuilt), len(self._build.units),
+            ", ".join(format(i + 1) for i in rebuilt) or "-"), "msgok")
+        try:
+            cmd = self._build.assemble()
+        except (IOError, OSError) as e:
+            self.output.writeMsg(i18n("Could not copy the output files: %1",
+                e.strerror), "msgerr")
+            return self._exit(False)
+        if not cmd:
+            return self._exit(True)
+        p = self._p = KProcess()
+        p.setOutputChannelMode(KProcess.MergedChannels)
+        p.setProgram(cmd)
+        p.finished.connect(self._assembled)
+        p.error.connect(self._assembleError)
+        p.readyRead.connect(self._readOutput)
+        p.start()
+    
+    def _assembled(self, exitCode, exitStatus):
+        self._writeOutput(self._parser.flush())
+        success = not (exitCode or exitStatus)
+        if not success:
+            self.output.writeMsg(i18n("Could not combine the PDF files."),
+                "msgerr")
+        # otherwise we delete ourselves during our event handler, causing crash
+        QTimer.singleShot(0, lambda: self._exit(success))
+    
+    def _assembleError(self, errCode):
+        if self._p.state() == QProcess.NotRunning:
+            self.output.writeMsg(i18n("Could not start %1 to combine the "
+                "PDF files.", self._p.program()[0]), "msgerr")
+            QTimer.singleShot(0, lambda: self._exit(False))
+    
+    def abort(self):
+        if self._job:
+            self._job.abort()
+        elif self._build:
+            if self._p:
+                self._p.terminate()
+        else:
+            super(IncrementalDocumentJob, self).abort()
+    
+    def kill(self):
+        if not self._build:
+            return super(IncrementalDocumentJob, self).kill()
+        if self._job:
+            self._job.done.disconnect(self._unitDone)
+            self._job.kill()
+            self._job = None
+        elif self._p:
+            self._p.finished.disconnect(self._assembled)
+            self._p.error.disconnect(self._assembleError)
+            self._p.readyRead.disconnect(self._readOutput)
+            self._p.kill()
+            self._p.waitForFinished(2000)
+        self._exit(False)
 
 
 class RunLilyPondDialog(KDialog):
@@ -288,7 +470,7 @@ class RunLilyPondDialog(KDialog):
         import ly.version
         
         # get all versions
-        ver = dict((path, lilyPondVersion(path)) for path in paths)
+        ver = ly.version.versions(paths)
         
         # default
         if default not in paths:
@@ -350,12 +532,16 @@ class RunLilyPondDialog(KDialog):
         # Focus our listbox:
         self.lilypond.setFocus()
         
-        # Disable the Run button if a job is running for this document
-        oldjob = self.mainwin.jobManager().job(doc)
+        # Disable the Run button if a job is running or waiting for this
+        # document
+        man = self.mainwin.jobManager()
+        oldjob = man.job(doc)
         self.enableButtonOk(not oldjob)
         if oldjob:
             enable = lambda: self.enableButtonOk(True)
+            cancelled = lambda job: job is oldjob and enable()
             oldjob.done.connect(enable)
+            man.jobCancelled.connect(cancelled)
         
         # Wait for user interaction:
         result = self.exec_()
@@ -363,6 +549,7 @@ class RunLilyPondDialog(KDialog):
         # If a job was running, don't listen to it anymore
         if oldjob:
             oldjob.done.disconnect(enable)
+            man.jobCancelled.disconnect(cancelled)
         
         if not result:
             return False # cancelled
@@ -377,6 +564,15 @@ class RunLilyPondDialog(KDialog):
 
 
 class LogWidget(QTextBrowser):
+    """
+    Displays the output of LilyPond.
+    
+    Written text is collected and inserted at most every flushInterval
+    milliseconds, so a lot of output does not slow down the GUI. Only the
+    last "log max lines" lines are kept in the widget, the full text is
+    appended to a temporary file at the same time (see rawText()).
+    """
+    flushInterval = 50  # msec
     
     def __init__(self, parent=None):
         QTextBrowser.__init__(self, parent)
@@ -385,6 +581,27 @@ class LogWidget(QTextBrowser):
         self.setOpenExternalLinks(False)
         self.insertCursor = QTextCursor(self.document())
         self.formats = textFormats()
+        self.document().setMaximumBlockCount(
+            config("preferences").readEntry("log max lines", 10000))
+        self._pending = []      # (text, QTextCharFormat) tuples to insert
+        self._atLineStart = True
+        self._lines = 0         # the number of newlines written
+        self._raw = None        # temporary file with all the text
+        self._flushTimer = QTimer(self)
+        self._flushTimer.setSingleShot(True)
+        self._flushTimer.setInterval(self.flushInterval)
+        self._flushTimer.timeout.connect(self.flush)
+    
+    def clear(self):
+        self._pending = []
+        self._flushTimer.stop()
+        self._atLineStart = True
+        self._lines = 0
+        if self._raw:
+            self._raw.seek(0)
+            self._raw.truncate()
+        QTextBrowser.clear(self)
+        self.insertCursor = QTextCursor(self.document())
     
     def checkScroll(self, func):
         """
@@ -400,12 +617,61 @@ class LogWidget(QTextBrowser):
             sb.setValue(sb.maximum())
         
     def write(self, text, format='log'):
-        self.checkScroll(lambda:
-            self.insertCursor.insertText(text, self.formats[format]))
+        if not text:
+            return
+        if not isinstance(format, QTextCharFormat):
+            format = self.formats[format]
+        self._pending.append((text, format))
+        self._atLineStart = text.endswith('\n')
+        self._lines += text.count('\n')
+        if not self._flushTimer.isActive():
+            self._flushTimer.start()
+
+    def flush(self):
+        """ Inserts the written text that is not yet displayed. """
+        self._flushTimer.stop()
+        pending, self._pending = self._pending, []
+        if pending:
+            if self._raw is None:
+                self._raw = tempfile.TemporaryFile()
+            self._raw.seek(0, 2)
+            self._raw.write(''.join(text for text, f in pending).encode('utf-8'))
+            self.checkScroll(lambda: self._insert(pending))
+    
+    def _insert(self, pending):
+        """ Inserts the (text, format) tuples, joining texts with the same
+        format. """
+        cursor = self.insertCursor
+        cursor.beginEditBlock()
+        texts, format = [], pending[0][1]
+        for text, f in pending:
+            if f is not format:
+                cursor.insertText(''.join(texts), format)
+                texts, format = [], f
+            texts.append(text)
+        cursor.insertText(''.join(texts), format)
+        cursor.endEditBlock()
+    
+    def lineCount(self):
+        """ Returns the number of the line written text currently goes to. """
+        return self._lines
+    
+    def firstLine(self):
+        """ Returns the number of the first line the widget still displays. """
+        maxLines = self.document().maximumBlockCount()
+        return max(0, self._lines + 1 - maxLines) if maxLines > 0 else 0
+    
+    def rawText(self):
+        """ Returns all text written since the last clear(). """
+        self.flush()
+        if not self._raw:
+            return ''
+        self._raw.seek(0)
+        return self._raw.read().decode('utf-8')
 
     def writeMsg(self, text, format='msg'):
         # start on a new line if necessary
-        if self.insertCursor.columnNumber() > 0:
+        if not self._atLineStart:
             self.write('\n', format)
         self.write(text, format)
 
@@ -425,6 +691,7 @@ class Log(LogWidget):
         self.tool = tool
         self.doc = doc
         self.anchors = {}
+        self.anchorLines = deque() # (line, anchor) tuples, oldest first
         self.anchorgen = anchorgen()
         LogWidget.__init__(self, tool.widget)
         self.anchorClicked.connect(self.slotAnchorClicked)
@@ -434,8 +701,17 @@ class Log(LogWidget):
     
     def clear(self):
         self.anchors.clear()
+        self.anchorLines.clear()
         self.anchorgen = anchorgen()
         super(Log, self).clear()
+    
+    def flush(self):
+        """ Also forgets the anchors of lines that are not displayed anymore.
+        """
+        super(Log, self).flush()
+        first = self.firstLine()
+        while self.anchorLines and self.anchorLines[0][0] < first:
+            del self.anchors[self.anchorLines.popleft()[1]]
         
     def show(self):
         """ Really show our log, e.g. when there are errors """
@@ -445,10 +721,11 @@ class Log(LogWidget):
     def writeFileRef(self, text, path, line, column, tooltip=None, format='url'):
         anchor = next(self.anchorgen)
         self.anchors[anchor] = FileRef(self.doc.app, path, line, column)
-        f = self.formats[format]
+        self.anchorLines.append((self.lineCount(), anchor))
+        f = QTextCharFormat(self.formats[format])
         f.setAnchorHref(anchor)
         f.setToolTip(tooltip or i18n("Click to edit this file"))
-        self.write(text, format)
+        self.write(text, f)
         self.show() # because this refers to a warning or error
     
     def slotAnchorClicked(self, url):
@@ -472,7 +749,7 @@ class Log(LogWidget):
 
     def copyLog(self):
         text = (self.textCursor().selection().toPlainText()
-                or self.toPlainText())
+                or self.rawText())
         if text:
             KApplication.clipboard().setText(text)
         
@@ -489,7 +766,7 @@ class Log(LogWidget):
         encoding = dlg.selectedEncoding()
         fileName = dlg.selectedFile()
         text = (self.textCursor().selection().toPlainText()
-                or self.toPlainText())
+                or self.rawText())
         try:
             with open(fileName, 'w') as f:
                 f.write(text.encode(encoding, 'replace'))
@@ -611,6 +888,70 @@ class LocalFileManager(object):
         return lyfile
  
 
+_tempBase = None
+_tempDirectories = [] # released directories that can be used again
+
+def tempDirectory():
+    """
+    Returns an empty temporary directory for a BackgroundJob.
+    Directories given back with releaseTempDirectory() are used again.
+    All are created in one directory, that is removed when the application
+    quits.
+    """
+    global _tempBase
+    if _tempDirectories:
+        return _tempDirectories.pop()
+    if _tempBase is None:
+        base = _tempBase = tempfile.mkdtemp(prefix='frescobaldi-')
+        KApplication.instance().aboutToQuit.connect(
+            lambda: shutil.rmtree(base, ignore_errors=True))
+    return tempfile.mkdtemp(dir=_tempBase)
+
+def releaseTempDirectory(directory):
+    """
+    Empties the directory, so tempDirectory() can return it again.
+    """
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except (IOError, OSError):
+            return # leave it alone, it is removed on quit
+    _tempDirectories.append(directory)
+
+
+_previewCache = None
+
+def previewCache():
+    """
+    Returns the ly.buildcache.BuildCache that keeps the PDFs of previews,
+    or None if the build cache is disabled.
+    """
+    global _previewCache
+    size = config("preferences").readEntry("build cache size", 100)
+    if size:
+        if _previewCache is None:
+            import ly.buildcache
+            _previewCache = ly.buildcache.BuildCache(
+                KGlobal.dirs().saveLocation('cache', 'frescobaldi/preview/'))
+        _previewCache.maxSize = size * 1024 * 1024
+        return _previewCache
+
+def previewKey(text):
+    """
+    Returns the key to store the preview of the LilyPond text in the
+    previewCache(). Files the text includes are not looked at.
+    """
+    command = lilyPondCommand()
+    include = config("preferences").readPathEntry("lilypond include path", [])
+    key = repr((text, command, format(lilyPondVersion(command) or ''),
+                list(include)))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
 class BackgroundJob(object):
     """
     Manages LilyPond jobs in the background. Can display a dialog with the log
@@ -624,7 +965,7 @@ class BackgroundJob(object):
         
     def directory(self):
         if self._directory is None:
-            self._directory = tempfile.mkdtemp()
+            self._directory = tempDirectory()
         return self._directory
         
     def run(self, text, fileName='output.ly'):
@@ -651,10 +992,10 @@ class BackgroundJob(object):
         """
         if self.job:
             self.job.done.disconnect(self.finished)
-            self.job.abort()
+            self.job.kill()
             self.job = None
         if self._directory:
-            shutil.rmtree(self._directory)
+            releaseTempDirectory(self._directory)
             self._directory = None
     
     def showLog(self, message, title='', parent=None):
@@ -675,11 +1016,23 @@ class LilyPreviewWidget(BackgroundJob, QStackedWidget):
     """
     A widget that can display a string of LilyPond code as a PDF.
     If the code is changed, the PDF is automagically rebuilt.
-    Also the signal done(success) is then emitted.
+    
+    At most one LilyPond job runs at a time. Texts given while it runs wait,
+    and only the last one is run after it. The PDFs are kept in the
+    previewCache(), so a text that was shown before is shown again at once.
     """
+    
+    previewDelay = 300 # msec to wait for more changes before running LilyPond
+    
     def __init__(self, *args):
         QStackedWidget.__init__(self, *args)
         BackgroundJob.__init__(self)
+        self._pending = None    # the (text, key) to run next
+        self._wanted = None     # the key of the text that should be shown
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.previewDelay)
+        self._timer.timeout.connect(self._runPending)
         # The widget stack has two widgets, a log and a PDF preview.
         # the Log is already created in BackgroundJob
         self.addWidget(self.log)
@@ -715,18 +1068,61 @@ class LilyPreviewWidget(BackgroundJob, QStackedWidget):
     def preview(self, text):
         """
         Runs LilyPond on the text and update the preview.
+        
+        LilyPond is started when there were no new calls during previewDelay
+        msec and the previous job has finished.
         """
-        if self.job:
-            self.job.disconnect(self.finished)
-            self.job.abort()
-        self.run(text, 'preview.ly')
-        self.setCurrentWidget(self.log)
+        key = self._wanted = previewKey(text)
+        if self.showCached(key) or (self.job and self.job.previewKey == key):
+            self._pending = None
+            self._timer.stop()
+        else:
+            self._pending = text, key
+            self._timer.start()
     
+    def showCached(self, key):
+        """
+        Shows the PDF stored in the previewCache() under the key.
+        Returns True if there was one.
+        """
+        cache = previewCache()
+        if cache:
+            directory = os.path.join(self.directory(), 'cache')
+            if not os.path.isdir(directory):
+                os.mkdir(directory)
+            pdfs = [f for f in cache.restore(key, directory) or []
+                    if f.endswith('.pdf')]
+            if pdfs:
+                self.openPDF(pdfs[0])
+                return True
+        return False
+        
+    def _runPending(self):
+        """
+        Starts LilyPond on the pending text, if no job is running.
+        """
+        if self._pending and not self.job and not self._timer.isActive():
+            text, key = self._pending
+            self._pending = None
+            self.run(text, 'preview.ly')
+            self.job.previewKey = key
+            self.setCurrentWidget(self.log)
+        
     def finished(self):
-        pdfs = self.job.updatedFiles()("pdf")
+        job, self.job = self.job, None
+        pdfs = job.updatedFiles()("pdf")
         if pdfs:
-            self.openPDF(pdfs[0])
-        self.job = None
+            cache = previewCache()
+            if cache:
+                cache.store(job.previewKey, pdfs)
+            if job.previewKey == self._wanted:
+                self.openPDF(pdfs[0])
+        self._runPending()
+    
+    def cleanup(self):
+        self._timer.stop()
+        self._pending = None
+        BackgroundJob.cleanup(self)
 
     def openPDF(self, fileName):
         if self.part:
@@ -794,10 +1190,3 @@ def anchorgen(num = 0):
     for num in count(num):
         yield "anchor{0}".format(num)
 
-
-def scmbool(value):
-    """
-    Returns the Scheme notation for the boolean value.
-    """
-    return "#t" if value else "#f"
-
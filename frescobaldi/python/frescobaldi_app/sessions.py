@@ -67,8 +67,7 @@ class EditorDialog(kateshell.sessions.EditorDialog):
         default = conf.readEntry("default", "lilypond")
         
         # get all versions
-        ver = dict((path, ly.version.LilyPondInstance(path).version())
-                   for path in paths)
+        ver = ly.version.versions(paths)
         paths.sort(key=ver.get)
         self._paths = paths
         self.lilyVer.clear()
@@ -26,8 +26,8 @@ Config dialog
 from PyQt4.QtCore import QSize, Qt
 from PyQt4.QtGui import (
     QCheckBox, QComboBox, QGridLayout, QGroupBox, QHBoxLayout, QLabel,
-    QLineEdit, QListWidget, QListWidgetItem, QRadioButton, QTextEdit, QTreeView,
-    QVBoxLayout, QWidget)
+    QLineEdit, QListWidget, QListWidgetItem, QRadioButton, QSpinBox, QTextEdit,
+    QTreeView, QVBoxLayout, QWidget)
 from PyKDE4.kdecore import KGlobal, KUrl, i18n
 from PyKDE4.kdeui import (
     KDialog, KHBox, KIcon, KMessageBox, KPageDialog, KPushButton,
@@ -305,27 +305,81 @@ class RunningLilyPond(CheckGroup):
         layout.addWidget(
             self.addCheckBox(i18n("Run LilyPond with verbose output"),
                 "verbose lilypond output", False))
+        layout.addWidget(
+            self.addCheckBox(i18n("Compile every score or bookpart "
+                "separately, and only if it changed"),
+                "incremental build", False))
 
         h = KHBox()
         QLabel(i18n("LilyPond include path:"), h)
         self.includePath = FilePathEdit(h)
         self.includePath.changed.connect(page.changed)
         layout.addWidget(h)
+        
+        h = KHBox()
+        l = QLabel(i18n("Maximum number of LilyPond jobs:"), h)
+        self.maxJobs = QSpinBox(h)
+        self.maxJobs.setRange(0, 64)
+        self.maxJobs.setSpecialValueText(i18n("Number of processors"))
+        self.maxJobs.valueChanged.connect(page.changed)
+        l.setBuddy(self.maxJobs)
+        h.setToolTip(i18n(
+            "The number of LilyPond jobs that may run at the same time. "
+            "Other jobs wait until a running job has finished."))
+        layout.addWidget(h)
+        
+        h = KHBox()
+        l = QLabel(i18n("Size of the build cache:"), h)
+        self.buildCacheSize = QSpinBox(h)
+        self.buildCacheSize.setRange(0, 10000)
+        self.buildCacheSize.setSingleStep(10)
+        self.buildCacheSize.setSuffix(i18n(" MB"))
+        self.buildCacheSize.setSpecialValueText(i18n("Disabled"))
+        self.buildCacheSize.valueChanged.connect(page.changed)
+        l.setBuddy(self.buildCacheSize)
+        h.setToolTip(i18n(
+            "If the document and the files it includes did not change since "
+            "an earlier LilyPond run, the output files of that run are used "
+            "instead of running LilyPond again."))
+        layout.addWidget(h)
+        
+        h = KHBox()
+        l = QLabel(i18n("Maximum number of lines in the log:"), h)
+        self.logMaxLines = QSpinBox(h)
+        self.logMaxLines.setRange(0, 1000000)
+        self.logMaxLines.setSingleStep(1000)
+        self.logMaxLines.setSpecialValueText(i18n("Unlimited"))
+        self.logMaxLines.valueChanged.connect(page.changed)
+        l.setBuddy(self.logMaxLines)
+        h.setToolTip(i18n(
+            "Older lines are removed from the log, but \"Save As\" "
+            "still saves the full log."))
+        layout.addWidget(h)
 
     def defaults(self):
         super(RunningLilyPond, self).defaults()
         self.includePath.clear()
+        self.maxJobs.setValue(0)
+        self.buildCacheSize.setValue(100)
+        self.logMaxLines.setValue(10000)
         
     def loadSettings(self):
         super(RunningLilyPond, self).loadSettings()
+        conf = config("preferences")
         self.includePath.setValue(
-            config("preferences").readPathEntry("lilypond include path", []))
+            conf.readPathEntry("lilypond include path", []))
+        self.maxJobs.setValue(conf.readEntry("max lilypond jobs", 0))
+        self.buildCacheSize.setValue(conf.readEntry("build cache size", 100))
+        self.logMaxLines.setValue(conf.readEntry("log max lines", 10000))
 
     def saveSettings(self):
         super(RunningLilyPond, self).saveSettings()
         conf = config("preferences")
         conf.writePathEntry("lilypond include path",
             self.includePath.value())
+        conf.writeEntry("max lilypond jobs", self.maxJobs.value())
+        conf.writeEntry("build cache size", self.buildCacheSize.value())
+        conf.writeEntry("log max lines", self.logMaxLines.value())
 
 
 class SavingDocument(CheckGroup):
@@ -672,7 +726,8 @@ class LilyPondVersions(SettingsGroup):
         paths = conf.readEntry("paths", ["lilypond"])
         default = conf.readEntry("default", "lilypond")
         # sort on version and move erratic entries to the end
-        paths.sort(key=lambda path: ly.version.LilyPondInstance(path).version() or (999,))
+        ver = ly.version.versions(paths)
+        paths.sort(key=lambda path: ver[path] or (999,))
         for path in paths:
             info = LilyPondInfoItem(path)
             info.loadSettings(conf.group(path))
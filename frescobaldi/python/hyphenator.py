@@ -16,7 +16,7 @@ License: LGPL. More info: http://python-hyphenator.googlecode.com/
 """
 from __future__ import unicode_literals
 
-import re
+import marshal, os, re, sys, threading
 
 
 __all__ = ("Hyphenator",)
@@ -24,6 +24,14 @@ __all__ = ("Hyphenator",)
 # cache of per-file HyphenationDictionary objects
 _hdcache = {}
 
+# compiled pattern files are only valid for the same format and Python version
+_compiledVersion = "1 " + sys.version.split()[0]
+
+def _signature(filename):
+    """Returns a string describing the size and modification time of a file."""
+    s = os.stat(filename)
+    return "{0} {1!r}".format(s.st_size, s.st_mtime)
+
 # precompile some regular expressions
 parse = re.compile(r'(\d?)(\D?)').findall
 
@@ -89,12 +97,41 @@ class DataInt(int):
 class HyphenationDictionary(object):
     """Reads a hyph_*.dic file and stores the hyphenation patterns.
     
+    The patterns are stored as a trie, flattened into one dictionary: it maps
+    every pattern to its offset and values, and every other prefix of a
+    pattern to 0. So while looking up longer and longer substrings starting
+    at some position in a word, we can stop at the first one that is not in
+    the dictionary.
+    
     Parameters:
     filename : filename of hyph_*.dic pattern file to read
+    compiled : if given, filename of a file to store the parsed patterns in,
+               so that the next time they can be loaded much faster
     
     """
-    def __init__(self, filename):
-        self.patterns = {}
+    # maximum number of words in the cache
+    cachesize = 10000
+    
+    def __init__(self, filename, compiled=None):
+        # two generations of cached words, see positions()
+        self.cache, self._oldCache = {}, {}
+        self._cacheLock = threading.Lock() # positions() is used from threads
+        if not compiled or not self.load(filename, compiled):
+            self.trie, alternatives = self.parse(filename)
+            if compiled:
+                self.save(filename, compiled, alternatives)
+            self.setAlternatives(alternatives)
+    
+    @staticmethod
+    def parse(filename):
+        """Reads a hyph_*.dic file.
+        
+        Returns the trie (with plain integer values) and a dictionary mapping
+        the patterns with nonstandard hyphenation to their values.
+        
+        """
+        trie, alternatives = {}, {}
+        setdefault = trie.setdefault
         with open(filename) as f:
             charset = f.readline().strip()
             if charset.startswith('charset '):
@@ -122,10 +159,61 @@ class HyphenationDictionary(object):
                         start += 1
                     while not values[end-1]:
                         end -= 1
-                    self.patterns[''.join(tag)] = start, values[start:end]
-        self.cache = {}
-        self.maxlen = max(map(len, self.patterns))
-
+                    values = values[start:end]
+                    tag = ''.join(tag)
+                    for i in range(1, len(tag)):
+                        setdefault(tag[:i], 0)
+                    trie[tag] = start, tuple(map(int, values))
+                    if factory is int:
+                        alternatives.pop(tag, None)
+                    else:
+                        alternatives[tag] = values
+        return trie, alternatives
+    
+    def setAlternatives(self, alternatives):
+        """Puts the values of patterns with nonstandard hyphenation in the trie.
+        
+        Those values contain DataInt instances with the hyphenation data.
+        
+        """
+        trie = self.trie
+        for tag, values in alternatives.iteritems():
+            trie[tag] = trie[tag][0], tuple(values)
+    
+    def load(self, filename, compiled):
+        """Loads the patterns from the compiled file.
+        
+        Returns False if that is not possible, e.g. because it does not exist
+        or because the hyph_*.dic file has changed.
+        
+        """
+        try:
+            with open(compiled, 'rb') as f:
+                version, signature, trie, alternatives = marshal.load(f)
+            if (version, signature) != (_compiledVersion, _signature(filename)):
+                return False
+        except (EnvironmentError, EOFError, ValueError, TypeError):
+            return False
+        self.trie = trie
+        self.setAlternatives(dict((tag, [DataInt(v, data) if data else v
+                                         for v, data in values])
+                                  for tag, values in alternatives.iteritems()))
+        return True
+    
+    def save(self, filename, compiled, alternatives):
+        """Saves the trie (that must not yet contain alternatives)."""
+        alternatives = dict((tag, tuple((int(v), getattr(v, 'data', None))
+                                        for v in values))
+                            for tag, values in alternatives.iteritems())
+        data = (_compiledVersion, _signature(filename), self.trie, alternatives)
+        temp = compiled + '.tmp'
+        try:
+            with open(temp, 'wb') as f:
+                marshal.dump(data, f)
+            os.rename(temp, compiled)
+        except EnvironmentError:
+            pass
+    
     def positions(self, word):
         """Returns a list of positions where the word can be hyphenated.
         
@@ -144,25 +232,60 @@ class HyphenationDictionary(object):
         cut: how many characters to remove while substituting the nonstandard
             hyphenation
         
+        The most recently used words are cached. This method may be called
+        from more than one thread at the same time.
+        
         """
         word = word.lower()
-        try:
-            return self.cache[word]
-        except KeyError:
-            pass
+        with self._cacheLock:
+            positions = self.cache.get(word)
+            if positions is not None:
+                return positions
+            positions = self._oldCache.pop(word, None)
+            if positions is not None:
+                self._cacheWord(word, positions)
+                return positions
+        positions = self._positions(word)
+        with self._cacheLock:
+            self._cacheWord(word, positions)
+        return positions
+    
+    def _cacheWord(self, word, positions):
+        """Caches the positions of the word (call with the lock held).
+        
+        When the cache holds half of cachesize words, it becomes the old
+        generation and the previous old generation is dropped. A word found
+        in the old generation is moved back to the new one, so the words used
+        recently stay cached.
+        
+        """
+        if len(self.cache) >= self.cachesize // 2:
+            self._oldCache, self.cache = self.cache, {}
+        self.cache[word] = positions
+    
+    def clearCache(self):
+        """Forgets all cached words."""
+        with self._cacheLock:
+            self.cache, self._oldCache = {}, {}
+    
+    def _positions(self, word):
+        """Computes the hyphenation positions of the (lowercase) word."""
         prepWord = '.' + word + '.'
         res = [0] * (len(prepWord) + 1)
+        get = self.trie.get
+        end = len(prepWord) + 1
         for i in range(len(prepWord) - 1):
-            for j in range(i + 1, min(i + self.maxlen, len(prepWord)) + 1):
-                p = self.patterns.get(prepWord[i:j])
-                if p:
+            # walk the trie along the patterns starting at i
+            for j in range(i + 1, end):
+                p = get(prepWord[i:j])
+                if p is None:
+                    break
+                elif p:
                     offset, values = p
-                    s = slice(i + offset, i + offset + len(values))
-                    res[s] = map(max, values, res[s])
-
-        positions = [DataInt(i - 1, ref=r) for i, r in enumerate(res) if r % 2]
-        self.cache[word] = positions
-        return positions
+                    for k, v in enumerate(values, i + offset):
+                        if v >= res[k]:
+                            res[k] = v
+        return [DataInt(i - 1, ref=r) for i, r in enumerate(res) if r % 2]
 
 
 class Hyphenator(object):
@@ -174,17 +297,21 @@ class Hyphenator(object):
     -left: make the first syllabe not shorter than this
     -right: make the last syllabe not shorter than this
     -cache: if true (default), use a cached copy of the dic file, if possible
+    -compiled: filename to store the parsed dic file in, to load it faster
+     the next time
 
     left and right may also later be changed:
       h = Hyphenator(file)
       h.left = 1
     
     """
-    def __init__(self, filename, left=2, right=2, cache=True):
+    def __init__(self, filename, left=2, right=2, cache=True, compiled=None):
+        self.filename = filename
+        self.compiled = compiled
         self.left  = left
         self.right = right
         if not cache or filename not in _hdcache:
-            _hdcache[filename] = HyphenationDictionary(filename)
+            _hdcache[filename] = HyphenationDictionary(filename, compiled)
         self.hd = _hdcache[filename]
 
     def positions(self, word):
@@ -248,11 +375,97 @@ class Hyphenator(object):
                 l.insert(p, hyphen)
         return ''.join(l)
 
+    def batch(self, words, hyphen='-', processes=1, chunksize=1000):
+        """Returns a list with all the words with the hyphens inserted.
+        
+        words may be any iterable. Every distinct word is hyphenated only once,
+        and the results are returned in the order of the words.
+        
+        If processes is not 1, the distinct words are divided in chunks of
+        chunksize words over a pool of that many worker processes (None means
+        the number of CPUs). The results are the same as with one process.
+        
+        """
+        words = list(words)
+        seen, unique = set(), []
+        for word in words:
+            if word not in seen:
+                seen.add(word)
+                unique.append(word)
+        if processes == 1 or len(unique) <= chunksize:
+            results = [self.inserted(word, hyphen) for word in unique]
+        else:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes, _initWorker,
+                (self.filename, self.left, self.right, self.compiled))
+            try:
+                chunks = [(unique[i:i+chunksize], hyphen)
+                          for i in range(0, len(unique), chunksize)]
+                results = [result for chunk in pool.map(_inserted, chunks)
+                                  for result in chunk]
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        results = dict(zip(unique, results))
+        return [results[word] for word in words]
+
     __call__ = iterate
 
 
+# the Hyphenator of a worker process used by Hyphenator.batch()
+_worker = None
+
+def _initWorker(filename, left, right, compiled):
+    global _worker
+    _worker = Hyphenator(filename, left, right, compiled=compiled)
+
+def _inserted(args):
+    words, hyphen = args
+    return [_worker.inserted(word, hyphen) for word in words]
+
+
+def benchmark(filename, words, processes=None, compiled=None, repeat=3):
+    """Hyphenates the words in several ways and returns a list of
+    (description, words per second) tuples.
+    
+    Every way is timed repeat times, and the best time is used. The word
+    caches are emptied before every run.
+    
+    """
+    import time
+    words = list(words)
+    h = Hyphenator(filename, compiled=compiled)
+    def run(description, func):
+        best = None
+        for i in range(repeat):
+            h.hd.clearCache()
+            start = time.time()
+            func()
+            t = time.time() - start
+            best = t if best is None else min(best, t)
+        return description, len(words) / best if best else float('inf')
+    return [
+        run("word by word", lambda: [h.inserted(w) for w in words]),
+        run("batch", lambda: h.batch(words)),
+        run("batch, {0} processes".format(processes or "all"),
+            lambda: h.batch(words, processes=processes)),
+    ]
+
+
 if __name__ == "__main__":
     import sys
+    if sys.argv[1:2] == ['-b'] and len(sys.argv) > 3:
+        # python hyphenator.py -b dict_file words_file [processes]
+        dict_file, words_file = sys.argv[2:4]
+        processes = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        with open(words_file) as f:
+            words = re.findall(r'\w+', f.read().decode('utf-8'), re.UNICODE)
+        print "{0} words, {1} distinct".format(len(words), len(set(words)))
+        for description, speed in benchmark(dict_file, words, processes):
+            print "{0}: {1:.0f} words/s".format(description, speed)
+        sys.exit(0)
+
     dict_file = sys.argv[1]
     word = sys.argv[2].decode('latin1')
 
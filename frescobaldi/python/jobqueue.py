@@ -0,0 +1,297 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+"""
+A queue that runs a limited number of jobs at the same time.
+
+A job is an object with a start() and an abort() method and a done Signal,
+that is emitted with the arguments (success, job) when the job has finished.
+The LilyPond jobs in frescobaldi_app.runlily are jobs, and so is ProcessJob,
+that runs a command without needing Qt or KDE.
+
+HeadlessJobQueue runs ProcessJobs from a script, e.g.:
+
+    python jobqueue.py -j 4 *.ly
+
+runs LilyPond on all the files, four at a time.
+"""
+
+import heapq, itertools, os, subprocess, sys, time
+
+from signals import Signal
+
+
+def cpuCount():
+    """Returns the number of processors, or 1 if that can't be determined."""
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def commandLine(lyfile, command="lilypond", arguments=("--pdf",), include=(),
+                preview=False, verbose=False, delfiles=True):
+    """Returns the command line (a list) to run LilyPond on lyfile.
+
+    LilyPond should be run in the directory of lyfile.
+
+    """
+    cmd = [command]
+    verbose and cmd.append("--verbose")
+    cmd.append("-dpoint-and-click=" + scmbool(preview))
+    cmd.append("-ddelete-intermediate-files=" + scmbool(delfiles))
+    for path in include:
+        cmd.append("--include")
+        cmd.append(path)
+    cmd.extend(arguments)
+    cmd.append(os.path.basename(lyfile))
+    return cmd
+
+def scmbool(value):
+    """Returns the Scheme notation for the boolean value."""
+    return "#t" if value else "#f"
+
+
+class JobQueue(object):
+    """Runs at most maxJobs jobs at the same time; other jobs wait in a queue.
+
+    Waiting jobs are started in order of priority (lower values first) and
+    then in the order they were added. maxJobs defaults to the number of
+    processors.
+
+    Emits:
+    jobQueued(job)
+    jobStarted(job)
+    jobFinished(job, success)
+    jobCancelled(job)       (when a waiting job is removed from the queue)
+
+    """
+    jobQueued = Signal()
+    jobStarted = Signal()
+    jobFinished = Signal()
+    jobCancelled = Signal()
+
+    def __init__(self, maxJobs=None):
+        self.maxJobs = maxJobs or cpuCount()
+        self._running = []
+        self._queue = []    # heap of (priority, number, job) tuples
+        self._numbers = itertools.count()
+        self._starting = False
+
+    def add(self, job, priority=0):
+        """Adds a job, that is started as soon as there is room for it."""
+        heapq.heappush(self._queue, (priority, next(self._numbers), job))
+        self.jobQueued(job)
+        self.startJobs()
+
+    def setMaxJobs(self, maxJobs=None):
+        """Changes the maximum number of jobs that run at the same time."""
+        self.maxJobs = maxJobs or cpuCount()
+        self.startJobs()
+
+    def startJobs(self):
+        """Starts waiting jobs while less than maxJobs jobs are running.
+
+        A job whose start() raises an exception is handled by _finished() as
+        a job that finished without success, so it does not keep occupying a
+        place. The other jobs are started, and then the (first) exception is
+        raised again.
+
+        """
+        if self._starting:
+            return  # called from _finished() while we are already starting
+        self._starting = True
+        exc_info = None
+        try:
+            while self._queue and len(self._running) < self.maxJobs:
+                job = heapq.heappop(self._queue)[2]
+                self._running.append(job)
+                job.done.connect(self._finished)
+                self.jobStarted(job)
+                try:
+                    job.start()
+                except Exception:
+                    exc_info = exc_info or sys.exc_info()
+                    job.done.disconnect(self._finished)
+                    if job in self._running:
+                        self._finished(False, job)
+        finally:
+            self._starting = False
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _finished(self, success, job):
+        self._running.remove(job)
+        self.jobFinished(job, success)
+        self.startJobs()
+
+    def cancel(self, job):
+        """Aborts the job if it is running, or removes it from the queue."""
+        if job in self._running:
+            job.abort()
+            return
+        for i, entry in enumerate(self._queue):
+            if entry[2] is job:
+                del self._queue[i]
+                heapq.heapify(self._queue)
+                self._cancelled(job)
+                return
+
+    def _cancelled(self, job):
+        self.jobCancelled(job)
+
+    def cancelAll(self):
+        """Removes all waiting jobs and aborts all running jobs."""
+        for job in self.waiting():
+            self.cancel(job)
+        for job in self.running():
+            self.cancel(job)
+
+    def running(self):
+        """Returns a list of the running jobs."""
+        return list(self._running)
+
+    def waiting(self):
+        """Returns a list of the waiting jobs, in the order they will run."""
+        return [entry[2] for entry in sorted(self._queue)]
+
+    def count(self):
+        """Returns the number of running jobs."""
+        return len(self._running)
+
+    def queueCount(self):
+        """Returns the number of waiting jobs."""
+        return len(self._queue)
+
+
+class ProcessJob(object):
+    """Runs a command (a list) in a directory, using the subprocess module.
+
+    The output (stdout and stderr) is written to the output file object
+    (if given) or discarded. As there is no event loop, poll() must be called
+    regularly; it emits done(success, job) when the process has finished.
+
+    """
+    done = Signal(fireOnce=True)
+
+    startTime = 0.0             # time.time() this job started
+    buildTime = 0.0             # time in seconds this job has been running
+    returncode = None           # the exit code of the process
+
+    def __init__(self, command, directory=None, output=None):
+        self.command = command
+        self.directory = directory
+        self.output = output
+        self.process = None
+
+    def start(self):
+        self.startTime = time.time()
+        output = self.output or open(os.devnull, 'w')
+        try:
+            self.process = subprocess.Popen(self.command, cwd=self.directory,
+                stdout=output, stderr=subprocess.STDOUT)
+        except OSError:
+            self.process = None
+        finally:
+            if output is not self.output:
+                output.close()
+
+    def abort(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+
+    def poll(self):
+        """Returns True and emits done() if the process has finished."""
+        if self.process:
+            self.returncode = self.process.poll()
+            if self.returncode is None:
+                return False
+        self.buildTime = time.time() - self.startTime
+        self.done(self.returncode == 0, self)
+        return True
+
+
+class HeadlessJobQueue(JobQueue):
+    """A JobQueue for ProcessJobs that can be used without an event loop."""
+    def wait(self, interval=0.05):
+        """Runs until all jobs have finished."""
+        while self._running:
+            for job in self.running():
+                job.poll()
+            if self._running:
+                time.sleep(interval)
+
+
+if __name__ == '__main__':
+
+    import optparse
+
+    op = optparse.OptionParser(usage='usage: %prog [options] filename...',
+        description='Runs LilyPond on many files, several at the same time.')
+    op.add_option('-j', '--jobs', type='int',
+        help='number of LilyPond jobs to run at the same time '
+             '[default: number of processors]')
+    op.add_option('-c', '--command', default='lilypond',
+        help='LilyPond command to run [default: %default]')
+    op.add_option('-p', '--preview', action='store_true',
+        help='run in preview mode (with point and click)')
+    op.add_option('-I', '--include', action='append', default=[],
+        help='add a directory to the include path')
+    op.add_option('-l', '--log', action='store_true',
+        help='write the output of every file to a .log file beside it')
+    options, args = op.parse_args()
+    if not args:
+        op.error('no files given')
+
+    queue = HeadlessJobQueue(options.jobs)
+    failed = []
+
+    def finished(job, success):
+        name = os.path.join(job.directory, job.command[-1])
+        if success:
+            sys.stdout.write('{0}: done ({1:.1f}s)\n'.format(name, job.buildTime))
+        else:
+            failed.append(name)
+            sys.stdout.write('{0}: failed ({1})\n'.format(name,
+                'return code {0}'.format(job.returncode)
+                if job.returncode is not None else 'could not start'))
+        if job.output:
+            job.output.close()
+    queue.jobFinished.connect(finished)
+
+    def started(job):
+        # open the log only now, to not run out of file descriptors
+        if options.log:
+            job.output = open(job.logfile, 'w')
+    queue.jobStarted.connect(started)
+
+    start = time.time()
+    for lyfile in args:
+        lyfile = os.path.abspath(lyfile)
+        job = ProcessJob(commandLine(lyfile, options.command,
+            include=[os.path.abspath(p) for p in options.include],
+            preview=options.preview), os.path.dirname(lyfile))
+        job.logfile = os.path.splitext(lyfile)[0] + '.log'
+        queue.add(job)
+    queue.wait()
+    sys.stdout.write('{0} files, {1} failed, {2:.1f}s\n'.format(
+        len(args), len(failed), time.time() - start))
+    sys.exit(1 if failed else 0)
@@ -19,7 +19,7 @@
 
 from __future__ import unicode_literals
 
-import os, re, sip, sys, time, weakref
+import os, re, sip, sys, threading, time, weakref
 from contextlib import contextmanager
 from functools import wraps
 
@@ -697,6 +697,19 @@ class Document(DBusItem):
         else:
             self._cursor = (line, column)
 
+    def translateCursors(self, positions):
+        """Translates many (line, column) positions at once.
+        
+        Lines start at 1, columns at 0, as with setCursorPosition(). The
+        positions are translated by the current CursorTranslator. Returns a
+        list of KTextEditor.Cursor instances, or None if the document is not
+        loaded.
+        
+        """
+        if self.view:
+            return self._cursorTranslator.cursors(
+                [(line - 1, column) for line, column in positions])
+
     @method(iface, in_signature='', out_signature='s')
     def text(self):
         """Returns the full text of the document."""
@@ -1090,6 +1103,10 @@ class CursorTranslator(object):
         if self.iface:
             self.iface.releaseRevision(self.revision)
         
+    # statistics of the revision translations, see throughput()
+    translated = 0
+    translateTime = 0.0
+    
     def cursor(self, line, column):
         """Translates a cursor position to the current document.
         
@@ -1097,64 +1114,151 @@ class CursorTranslator(object):
         Returns a KTextEditor.Cursor instance.
         
         """
-        if line < len(self.savedTabs) and self.savedTabs[line]:
-            column = resolvetabs_indices(column, self.savedTabs[line])
-        cursor = KTextEditor.Cursor(line, column)
-        if self.iface:
+        return self.cursors([(line, column)])[0]
+    
+    def cursors(self, positions):
+        """Translates a list of (line, column) positions at once.
+        
+        Returns a list of KTextEditor.Cursor instances. The revision is locked
+        only once for the whole list.
+        
+        """
+        cursors = []
+        for line, column in positions:
+            if line < len(self.savedTabs) and self.savedTabs[line]:
+                column = resolvetabs_indices(column, self.savedTabs[line])
+            cursors.append(KTextEditor.Cursor(line, column))
+        if self.iface and cursors:
             # Just because KDE 4.5 does a qFatal if useRevision is called in the
             # main thread, and the Python KDE4 bindings not yet provide the new
-            # MovingInterface stuff, we need to create a background thread just
-            # to translate cursors from a certain document revision.
+            # MovingInterface stuff, we need a background thread just to
+            # translate cursors from a certain document revision.
             @anonymousThread
-            def translateCursor(cursor):
+            def translateCursors(cursors):
                 self.iface.smartMutex().lock()
-                self.iface.useRevision(self.revision)
-                cursor = self.iface.translateFromRevision(cursor,
-                    KTextEditor.SmartCursor.MoveOnInsert)
-                self.iface.clearRevision()
-                self.iface.smartMutex().unlock()
-                return cursor
-            cursor = translateCursor(cursor)
-        return cursor
-
-
-class _AnonymousThread(QThread):
-    """Runs a function in an anonymous QThread.
+                start = time.time()
+                try:
+                    self.iface.useRevision(self.revision)
+                    cursors = [self.iface.translateFromRevision(cursor,
+                        KTextEditor.SmartCursor.MoveOnInsert)
+                        for cursor in cursors]
+                    self.iface.clearRevision()
+                finally:
+                    self.iface.smartMutex().unlock()
+                    CursorTranslator.translateTime += time.time() - start
+                return cursors
+            cursors = translateCursors(cursors)
+            CursorTranslator.translated += len(cursors)
+        return cursors
     
-    Exceptions are re-raised in the main thread.
+    @classmethod
+    def throughput(cls):
+        """Returns the number of cursors translated per second so far."""
+        if cls.translateTime:
+            return cls.translated / cls.translateTime
+        return 0.0
+
+
+class _WorkerThread(QThread):
+    """A QThread that runs functions on behalf of other threads.
+    
+    The thread is started once and reused, see workerThread().
+    Exceptions are re-raised in the calling thread.
     
     """
-    def __init__(self, func, args, kwargs):
-        super(_AnonymousThread, self).__init__()
-        self.func = lambda: func(*args, **kwargs)
-        self._result = None
-        self._exc_info = None
+    def __init__(self):
+        super(_WorkerThread, self).__init__()
+        self._lock = threading.Lock()
+        self._request = threading.Condition(self._lock)
+        self._calling = threading.Lock()    # one caller at a time
+        self._job = None
+        self._running = True
         self.start()
-        self.wait()
     
     def run(self):
-        try:
-            self._result = self.func()
-        except:
-            self._exc_info = sys.exc_info()
-            sys.exc_clear()
+        while True:
+            with self._lock:
+                while self._running and not self._job:
+                    self._request.wait()
+                if not self._job:
+                    return  # stopped; a job given before stop() still runs
+                func, result, done = self._job
+                self._job = None
+            # run the job unlocked, so stop() and new callers need not wait for it
+            try:
+                result.append(func())
+            except:
+                result.append(sys.exc_info())
+                done.error = True
+                sys.exc_clear()
+            done.set()
+    
+    def call(self, func, args, kwargs):
+        """Runs func(*args, **kwargs) in this thread and returns its result.
+        
+        Waits for the function to complete. After stop() (e.g. while the
+        application quits) this thread does not run functions anymore, and
+        the function is run in a short-lived thread of its own instead,
+        because some functions may not be called in the main thread.
+        
+        """
+        if QThread.currentThread() is self:
+            return func(*args, **kwargs)
+        result = []
+        done = threading.Event()
+        done.error = False
+        with self._calling:
+            with self._lock:
+                running = self._running
+                if running:
+                    self._job = (lambda: func(*args, **kwargs), result, done)
+                    self._request.notify()
+            if running:
+                done.wait()
+        if not running:
+            thread = _WorkerThread()
+            try:
+                return thread.call(func, args, kwargs)
+            finally:
+                thread.stop()
+        if done.error:
+            exc_info = result[0]
+            raise exc_info[1], None, exc_info[2]
+        return result[0]
     
-    def result(self):
-        """Returns a tuple (result, exception)."""
-        return self._result, self._exc_info
+    def stop(self):
+        """Ends the thread."""
+        with self._lock:
+            self._running = False
+            self._request.notify()
+        self.wait()
+
+
+_workerThread = None
+
+def workerThread():
+    """Returns the long-lived _WorkerThread, starting it if needed.
+    
+    The thread ends when the application quits.
+    
+    """
+    global _workerThread
+    if _workerThread is None:
+        _workerThread = _WorkerThread()
+        KApplication.instance().aboutToQuit.connect(_workerThread.stop)
+    return _workerThread
 
 
 def anonymousThread(func):
-    """Returns a wrapper for a func to run it in an anonymous QThread.
+    """Returns a wrapper for a func to run it in a background QThread.
     
     When called, waits for the function to complete and returns its result.
+    The function is run in the worker thread that is shared by all callers,
+    so no thread is created per call.
     
     """
     def wrapper(*args, **kwargs):
-        result, exc_info = _AnonymousThread(func, args, kwargs).result()
-        if exc_info:
-            raise exc_info[1], None, exc_info[2]
-        return result
+        return workerThread().call(func, args, kwargs)
     return wrapper
 
 
@@ -1191,15 +1295,15 @@ def resolvetabs_indices(column, indices):
     if not indices or column < indices[0]:
         return column
     charcol, realcol = 0, 0
-    # TODO: this loop can probably be optimized
-    while True:
-        if charcol in indices:
-            realcol = realcol + 8 & -8
-        else:
-            realcol += 1
+    # jump from tab to tab instead of walking every character
+    for tab in indices:
+        if realcol + tab - charcol > column:
+            break
+        realcol = (realcol + tab - charcol + 8) & -8
         if realcol > column:
-            return charcol
-        charcol += 1
+            return tab
+        charcol = tab + 1
+    return charcol + column - realcol
         
 def cursorToPosition(line, column, text):
     """Returns the character position in text of a cursor with line and column.
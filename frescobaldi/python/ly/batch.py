@@ -0,0 +1,263 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+"""
+Run the tools in ly.tools over many files, using a pool of processes.
+
+Every file is handled by a separate job. A job reads the file, runs a tool on
+the text and returns a Result containing the ChangeList (or the exception
+that was raised). The results are returned in the order of the filenames,
+so the outcome is the same as when the files are handled one by one.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import ly
+import ly.pitch
+import ly.tools
+import ly.version
+
+
+def transpose(text, transposer):
+    """ Returns a ChangeList transposing all pitches of text. """
+    return ly.tools.transpose(text, transposer)
+
+def translate(text, lang):
+    """
+    Returns a ChangeList translating the pitch names in text to lang.
+
+    If the text does not set the pitch language, a \\language command (or
+    \\include "lang.ly" for LilyPond before 2.13.38) is added below the
+    \\version command, like the editor does.
+    """
+    changes, includeCommandChanged = ly.tools.translate(text, lang)
+    if not includeCommandChanged:
+        version = ly.version.getVersion(text)
+        if version and version < (2, 13, 38):
+            command = '\\include "{0}.ly"\n'.format(lang)
+        else:
+            command = '\\language "{0}"\n'.format(lang)
+        pos = languageInsertPoint(text)
+        if pos and text[pos-1] not in '\r\n':
+            command = '\n' + command # the \\version line was the last one
+        changes.insert(pos, command)
+    return changes
+
+def languageInsertPoint(text):
+    """
+    Returns the position of the line below the \\version command in the first
+    20 lines of text, or 0 if there is none.
+    """
+    pos = 0
+    for line in text.splitlines(True)[:20]:
+        pos += len(line)
+        if re.search(r'\\version\s*".*?"', line):
+            return pos
+    return 0
+
+
+def readPitch(text, language='nederlands'):
+    """
+    Returns a ly.pitch.Pitch for text (e.g. "bes,") in the given pitch
+    name language, or None if the text is not understood.
+    """
+    p = ly.pitch.Pitch()
+    p.octave = ly.pitch.octaveToNum(text)
+    result = ly.pitch.pitchReader[language](
+        text.replace(",", "").replace("'", ""))
+    if result:
+        p.note, p.alter = result
+        return p
+
+
+class Result(object):
+    """
+    The outcome of running a tool over one file.
+
+    filename: the name of the file
+    changes:  the ChangeList returned by the tool, or None on failure
+    error:    the exception that was raised, or None
+    time:     the time in seconds that reading the file and running the
+              tool took
+    """
+    def __init__(self, filename, changes=None, error=None, time=0.0):
+        self.filename = filename
+        self.changes = changes
+        self.error = error
+        self.time = time
+
+    def count(self):
+        """ Returns the number of changes. """
+        return len(self.changes.changes()) if self.changes else 0
+
+    def text(self):
+        """ Returns the new text of the file. """
+        return self.changes.apply()
+
+
+def process(filename, function, args=(), encoding='utf-8'):
+    """
+    Reads the file and returns a Result for function(text, *args).
+
+    Exceptions are not raised but stored in the Result, so one file that
+    e.g. can't be translated does not stop the others.
+    """
+    start = time.time()
+    try:
+        with open(filename, 'rb') as f:
+            text = f.read().decode(encoding)
+        changes = function(text, *args)
+    except Exception as e:
+        return Result(filename, error=e, time=time.time() - start)
+    return Result(filename, changes, time=time.time() - start)
+
+def _process(job):
+    """ Unpacks a job tuple for process(), for use with Pool.imap(). """
+    return process(*job)
+
+def run(filenames, function, args=(), processes=None, encoding='utf-8'):
+    """
+    Yields a Result for function(text, *args) for every file, in order.
+
+    function must be a module-level function (like transpose or translate
+    in this module), and args must be picklable, as they are sent to the
+    worker processes. processes is the number of processes to use
+    (default: the number of CPUs); if it is 1, or there is only one file,
+    the files are handled in the current process.
+    """
+    jobs = [(filename, function, args, encoding) for filename in filenames]
+    if processes == 1 or len(jobs) < 2:
+        for job in jobs:
+            yield _process(job)
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(_process, jobs):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def write(filename, text, encoding='utf-8'):
+    """
+    Writes text to filename atomically.
+
+    The text is written to a temporary file in the same directory, which is
+    then renamed to filename. So filename either has its old or its new
+    contents, never something in between. The permissions of an existing
+    file are kept.
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(prefix='.' + name + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(text.encode(encoding))
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp, 0o666 & ~umask)
+        os.rename(temp, filename)
+    except:
+        os.remove(temp)
+        raise
+
+
+if __name__ == '__main__':
+
+    import sys, optparse
+    # use the functions from ly.batch, not __main__, so they can be pickled
+    import ly.batch
+
+    op = optparse.OptionParser(usage=
+        'usage: %prog [options] transpose FROM TO filename...\n'
+        '       %prog [options] translate LANGUAGE filename...')
+    op.add_option('-d', '--directory',
+        help='write the files to this directory instead of changing them '
+             'in place')
+    op.add_option('-j', '--jobs', type='int',
+        help='number of processes to use [default: number of CPUs]')
+    op.add_option('-l', '--language', default='nederlands',
+        help='pitch name language of FROM and TO [default: %default]')
+    op.add_option('-e', '--encoding', default='utf-8',
+        help='encoding of the files [default: %default]')
+    op.add_option('-n', '--dry-run', action='store_true',
+        help='do not write any files')
+    options, args = op.parse_args()
+
+    if args[:1] == ['transpose'] and len(args) > 3:
+        fromPitch = ly.batch.readPitch(args[1], options.language)
+        toPitch = ly.batch.readPitch(args[2], options.language)
+        if not fromPitch or not toPitch:
+            op.error('could not understand the pitches (language: {0})'.format(
+                options.language))
+        function = ly.batch.transpose
+        fargs = (ly.pitch.Transposer(fromPitch, toPitch),)
+        filenames = args[3:]
+    elif args[:1] == ['translate'] and len(args) > 2:
+        if args[1] not in ly.pitch.pitchWriter:
+            op.error('unknown language: {0}'.format(args[1]))
+        function = ly.batch.translate
+        fargs = (args[1],)
+        filenames = args[2:]
+    else:
+        op.error('please specify a command and one or more files')
+
+    if options.directory and not os.path.isdir(options.directory):
+        os.makedirs(options.directory)
+
+    start = time.time()
+    total = changed = failed = 0
+    for result in ly.batch.run(filenames, function, fargs, options.jobs,
+            options.encoding):
+        total += 1
+        if result.error is not None:
+            failed += 1
+            sys.stderr.write('{0}: failed: {1}\n'.format(result.filename,
+                result.error.__class__.__name__ + (
+                    ': {0}'.format(result.error) if unicode(result.error) else '')))
+            continue
+        count = result.count()
+        if not options.dry_run and (count or options.directory):
+            filename = result.filename
+            if options.directory:
+                filename = os.path.join(options.directory,
+                    os.path.basename(filename))
+            try:
+                ly.batch.write(filename, result.text(), options.encoding)
+            except EnvironmentError as e:
+                failed += 1
+                sys.stderr.write('{0}: failed: {1}\n'.format(filename, e))
+                continue
+        if count:
+            changed += 1
+        sys.stdout.write('{0}: {1} changes, {2} tokens, {3:.3f}s\n'.format(
+            result.filename, count, result.changes.scanned, result.time))
+    sys.stdout.write('{0} files, {1} changed, {2} failed, {3:.3f}s\n'.format(
+        total, changed, failed, time.time() - start))
+    sys.exit(failed and 1 or 0)
@@ -0,0 +1,198 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+"""
+Stores the output of LilyPond runs, so LilyPond needs not be run again
+when nothing has changed.
+"""
+
+import hashlib, os, re, shutil
+
+import ly.parse
+
+
+class BuildCache(object):
+    """Stores the files LilyPond created, by a hash of everything it read.
+
+    The key of a run is computed from the contents and names of the master
+    file and all files it (recursively) includes, the LilyPond version and
+    the command line. If a later run has the same key, the stored files
+    can be copied back instead of running LilyPond.
+
+    Every run is stored in a subdirectory of directory, named after the key.
+    If the total size of the stored files exceeds maxSize bytes, the least
+    recently used runs are removed.
+
+    """
+    def __init__(self, directory, maxSize=100*1024*1024, includeGraph=None):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.includeGraph = includeGraph or ly.parse.includeGraph
+        self._digests = {}  # path -> (mtime, size, sha1 digest)
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, filename):
+        """Returns the SHA1 digest of the contents of filename.
+
+        Digests are remembered as long as the modification time and size of
+        the file do not change.
+
+        """
+        s = os.stat(filename)
+        try:
+            mtime, size, digest = self._digests[filename]
+        except KeyError:
+            pass
+        else:
+            if (mtime, size) == (s.st_mtime, s.st_size):
+                return digest
+        h = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for data in iter(lambda: f.read(65536), b''):
+                h.update(data)
+        digest = h.digest()
+        self._digests[filename] = (s.st_mtime, s.st_size, digest)
+        return digest
+
+    def key(self, lyfile, command, version=None, include=()):
+        """Returns the key (a hexadecimal string) for running LilyPond.
+
+        lyfile is the master file, command the full command line (a list),
+        version the LilyPond version and include the list of directories
+        LilyPond searches for included files.
+
+        Returns None if one of the input files could not be read.
+
+        """
+        lyfile = os.path.abspath(lyfile)
+        h = hashlib.sha1()
+        h.update(repr((lyfile, list(command), format(version or ''),
+                       list(include))).encode('utf-8'))
+        try:
+            for filename in sorted(self.includeGraph.find(lyfile, include)):
+                h.update(filename.encode('utf-8') + b'\0')
+                h.update(self.digest(filename))
+        except (IOError, OSError):
+            return None
+        return h.hexdigest()
+
+    def restore(self, key, directory):
+        """Copies the files stored under key to directory.
+
+        Returns the list of restored files, or None if nothing was stored
+        under the key. The copies get the current time as modification time,
+        so they are seen as newly created.
+
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            names = os.listdir(entry)
+        except OSError:
+            self.misses += 1
+            return None
+        files = []
+        try:
+            for name in names:
+                filename = os.path.join(directory, name)
+                shutil.copyfile(os.path.join(entry, name), filename)
+                files.append(filename)
+            os.utime(entry, None)   # mark as recently used
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return files
+
+    def store(self, key, files):
+        """Stores copies of the files under key and removes old entries."""
+        if not key or not files:
+            return
+        entry = os.path.join(self.directory, key)
+        temp = '{0}.{1}.tmp'.format(entry, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            shutil.rmtree(temp, True)
+            os.mkdir(temp)
+            for filename in files:
+                shutil.copyfile(filename,
+                    os.path.join(temp, os.path.basename(filename)))
+            shutil.rmtree(entry, True)
+            os.rename(temp, entry)
+        except (IOError, OSError):
+            shutil.rmtree(temp, True)
+            return
+        self.expire()
+
+    def expire(self):
+        """Removes least recently used entries until maxSize is respected."""
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, name))
+                           for name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+            total += size
+        entries.sort()
+        for mtime, size, entry in entries:
+            if total <= self.maxSize:
+                break
+            shutil.rmtree(entry, True)
+            total -= size
+
+    def clear(self):
+        """Removes all stored files."""
+        shutil.rmtree(self.directory, True)
+        self._digests.clear()
+
+
+def outputFiles(lyfile, reftime, exclude=()):
+    """Returns the files LilyPond created for lyfile since reftime.
+
+    These are the files in the directory of lyfile, named after it, that
+    were modified at or after reftime (like mainapp.updatedFiles() finds).
+    Files in exclude (e.g. the included files) are skipped.
+
+    """
+    exclude = set(os.path.abspath(f) for f in exclude)
+    directory, name = os.path.split(os.path.abspath(lyfile))
+    base, ext = os.path.splitext(name)
+    pat = re.compile(r'{0}(-[^-]+)*\.[^.]+$'.format(re.escape(base)))
+    files = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return files
+    for f in names:
+        filename = os.path.join(directory, f)
+        if (f != name and pat.match(f) and filename not in exclude
+            and os.path.isfile(filename)):
+            try:
+                if os.path.getmtime(filename) >= reftime:
+                    files.append(filename)
+            except OSError:
+                pass
+    return files
@@ -0,0 +1,196 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+"""
+Parses the output of LilyPond while it is running.
+
+The output arrives in chunks, which may end anywhere, also in the middle of
+a file reference like "file.ly:12:4:". The Parser buffers the unfinished
+line, finds the file references in the text and collects the errors and
+warnings LilyPond prints as Diagnostic objects.
+"""
+
+import os, re
+from itertools import repeat
+
+
+# to find filenames with line:col pairs in LilyPond output
+_ref_re = re.compile(r"^((.*?):(\d+)(?::(\d+))?)(?=:)", re.M)
+
+# the start of a line that may still become a file reference
+_partial_ref_re = re.compile(r"^[^:]*(?::\d*){0,3}$")
+
+# progress output like "Interpreting music... [8]", never a file reference
+_progress_re = re.compile(r"\.\.\.|\[\d+\]")
+
+# an error or warning message
+_diagnostic_re = re.compile(
+    r"^(?:(.*?):(\d+)(?::(\d+))?: )?"
+    r"(fatal error|programming error|error|warning): (.*)$")
+
+
+class Diagnostic(object):
+    """An error or warning printed by LilyPond.
+
+    severity:   "error", "warning", "fatal error" or "programming error"
+    message:    the message text
+    filename:   the file the message refers to (or None)
+    line:       the line number (starting with 1, or None)
+    column:     the column (or None)
+    context:    a list of the lines LilyPond printed below the message,
+                normally the source line, split at the place of the error
+
+    """
+    def __init__(self, severity, message, filename=None, line=None,
+                 column=None, context=None):
+        self.severity = severity
+        self.message = message
+        self.filename = filename
+        self.line = line
+        self.column = column
+        self.context = context or []
+
+    def isError(self):
+        """Returns True if this is not just a warning."""
+        return self.severity != "warning"
+
+    def __repr__(self):
+        if self.filename:
+            return "<Diagnostic {0}:{1}:{2}: {3}: {4}>".format(
+                self.filename, self.line, self.column or 0,
+                self.severity, self.message)
+        return "<Diagnostic {0}: {1}>".format(self.severity, self.message)
+
+
+class Parser(object):
+    """Parses the output of one LilyPond run, given in chunks.
+
+    Relative filenames are resolved against directory. The Diagnostics are
+    kept in the diagnostics list, and if diagnostic is given, it is called
+    with every Diagnostic as soon as it is complete.
+
+    Use lines() if only complete lines are wanted, or feed() to get the
+    text split in pieces to display. At the end, call finish() or flush().
+
+    """
+    def __init__(self, directory=None, diagnostic=None):
+        self.directory = directory or ''
+        self.callback = diagnostic
+        self.diagnostics = []
+        self._buffer = ''       # the unfinished line
+        self._written = 0       # the length of _buffer feed() has returned
+        self._current = None    # the Diagnostic still reading context lines
+        self._contextLines = 0
+
+    def lines(self, text):
+        """Returns a list of the lines that were completed by text.
+
+        The newlines are stripped. The unfinished line at the end of text is
+        kept until a next call or finish().
+
+        """
+        lines = (self._buffer + text).split('\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self._parseLine(line)
+        return lines
+
+    def finish(self):
+        """Returns the unfinished line, if any, and completes the parsing."""
+        line, self._buffer = self._buffer, ''
+        if line:
+            self._parseLine(line)
+        self._complete()
+        return line
+
+    def feed(self, text):
+        """Returns the text as a list of (text, reference) tuples.
+
+        The reference is None or a (filename, line, column) tuple, if the text
+        is a file reference. An unfinished line is held back as long as it may
+        still become a file reference, i.e. while it looks like the start of
+        "file:line:col:" and does not contain progress output like "... " or
+        "[8]". (A filename may contain spaces, but not a colon.)
+
+        """
+        written = self._written
+        lines = self.lines(text)
+        pieces = []
+        for line in lines:
+            pieces.extend(self._pieces(line + '\n', written))
+            written = 0
+        rest = self._buffer
+        if rest and (written or not _partial_ref_re.match(rest)
+                     or _progress_re.search(rest)):
+            pieces.extend(self._pieces(rest, written))
+            written = len(rest)
+        self._written = written
+        return pieces
+
+    def flush(self):
+        """Returns the pieces of the unfinished line and completes the parsing.
+        """
+        written, self._written = self._written, 0
+        return self._pieces(self.finish(), written)
+
+    def references(self, text):
+        """Returns text as a list of (text, reference) tuples."""
+        parts = iter(_ref_re.split(text))
+        pieces = [(next(parts), None)]
+        for url, path, line, col, msg in zip(*repeat(parts, 5)):
+            path = os.path.join(self.directory, path)
+            pieces.append((url, (path, int(line or "1") or 1, int(col or "0"))))
+            pieces.append((msg, None))
+        return [piece for piece in pieces if piece[0]]
+
+    def _pieces(self, line, written):
+        """Returns the pieces of the part of line not written yet."""
+        if written:
+            return [(line[written:], None)] if line[written:] else []
+        return self.references(line)
+
+    def _parseLine(self, line):
+        line = line.rstrip('\r')
+        m = _diagnostic_re.match(line)
+        if m:
+            self._complete()
+            path, lineno, col, severity, message = m.groups()
+            if path:
+                path = os.path.join(self.directory, path)
+            self._current = Diagnostic(severity, message, path,
+                int(lineno) if lineno else None, int(col) if col else None)
+            self._contextLines = 2 if path else 0
+        elif self._current:
+            if self._contextLines and not _ref_re.match(line):
+                self._current.context.append(line)
+                self._contextLines -= 1
+            else:
+                self._contextLines = 0
+        if self._current and not self._contextLines:
+            self._complete()
+
+    def _complete(self):
+        """Adds the current Diagnostic."""
+        if self._current:
+            diagnostic, self._current = self._current, None
+            self.diagnostics.append(diagnostic)
+            if self.callback:
+                self.callback(diagnostic)
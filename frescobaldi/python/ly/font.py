@@ -21,22 +21,89 @@ from __future__ import unicode_literals
 
 """ Routines dealing with LilyPond fonts """
 
-import os, ly, xml.dom.minidom
+import os, ly
+
+# If set, SvgFontInfo indexes for the LilyPondInstance fonts are kept here.
+indexDirectory = None
+
+
+def glyphs(filename):
+    """
+    Yields (name, unicode) tuples for the glyphs in a SVG font file.
+    
+    The file is parsed incrementally and every element is discarded as soon
+    as it has been read, so the memory usage does not grow with the file size.
+    """
+    try:
+        from xml.etree.cElementTree import iterparse
+    except ImportError:
+        from xml.etree.ElementTree import iterparse
+    parents = []
+    for event, elem in iterparse(filename, (b'start', b'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == 'glyph' or elem.tag.endswith('}glyph'):
+            name = elem.get('glyph-name')
+            code = elem.get('unicode')
+            if name is not None and code is not None:
+                yield unicode(name), unicode(code)
+        if parents:
+            parents[-1].remove(elem)
+
 
 class SvgFontInfo(object):
     """
     Can load a SVG font and provide information about the glyphs and
     their unicode values.
+    
+    If index is given, it is the name of a file that is used to store the
+    glyph information, so the SVG font itself only needs to be read again
+    if it changes.
     """
-    def __init__(self, filename):
+    def __init__(self, filename, index=None):
         self.name2unicode = {}
-        doc = xml.dom.minidom.parse(filename)
-        glyphs = doc.getElementsByTagName('glyph')
-        for g in glyphs:
-            name = g.attributes["glyph-name"].value
-            code = g.attributes["unicode"].value
-            self.name2unicode[name] = code
-        doc.unlink()
+        if index and self.loadIndex(filename, index):
+            return
+        self.name2unicode.update(glyphs(filename))
+        if index:
+            self.saveIndex(filename, index)
+    
+    @staticmethod
+    def _signature(filename):
+        s = os.stat(filename)
+        return '{0} {1!r}'.format(s.st_size, s.st_mtime)
+        
+    def loadIndex(self, filename, index):
+        """
+        Reads the glyphs from the index file, if it belongs to the current
+        version of the font file. Returns True if that succeeded.
+        """
+        try:
+            with open(index) as f:
+                lines = f.read().decode('utf-8').splitlines()
+            if not lines or lines[0] != self._signature(filename):
+                return False
+            self.name2unicode = dict(line.split('\t', 1) for line in lines[1:])
+        except (IOError, OSError, ValueError, UnicodeError):
+            self.name2unicode = {}
+            return False
+        return True
+        
+    def saveIndex(self, filename, index):
+        """
+        Writes the glyphs to the index file. Errors are silently ignored.
+        """
+        lines = [self._signature(filename)]
+        lines.extend('\t'.join(item) for item in self.name2unicode.iteritems())
+        temp = index + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                f.write('\n'.join(lines).encode('utf-8'))
+            os.rename(temp, index)
+        except (IOError, OSError):
+            pass
         
     def glyph(self, glyphName):
         return self.name2unicode.get(glyphName, '')
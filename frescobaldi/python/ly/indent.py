@@ -75,7 +75,220 @@ class scheme:
 # searches for indent inside a string
 indent_rx = re.compile(r'\n([^\S\n]*)')
 
+
+class Indenter(object):
+    """
+    Indents LilyPond input, keeping its state (the stacks with the parsing
+    modes and the indents) between calls, so that the input can be indented
+    in pieces.
+    
+    The state can be saved with freeze() and restored with thaw(), so that a
+    range of lines can be re-indented given the state at its first line.
+    """
+    def __init__(self,
+            start = 0,
+            indentwidth = 2,
+            tabwidth = 8,
+            usetabs = False,
+            startscheme = False
+            ):
+        self.start = start
+        self.indentwidth = indentwidth
+        self.tabwidth = tabwidth
+        self.usetabs = usetabs
+        self.mode = [lily]      # the mode to parse in
+        self.indent = [start]   # stack with indent history
+        self.incomplete = False
+        if startscheme:
+            self.mode.append(scheme())
+    
+    def makeindent(self, i):
+        """ Returns the indent string for an indent of i spaces. """
+        if self.usetabs:
+            return '\t' * int(i / self.tabwidth) + ' ' * (i % self.tabwidth)
+        return ' ' * i
+    
+    def freeze(self):
+        """ Returns the current state as a tuple (modes, indents). """
+        modes = tuple(
+            mode is lily and 'lily' or mode is schemelily and 'schemelily'
+            or mode.depth for mode in self.mode)
+        return modes, tuple(self.indent)
+    
+    def thaw(self, state):
+        """ Restores a state returned by freeze(). """
+        modes, indents = state
+        self.mode = []
+        for mode in modes:
+            if mode == 'lily':
+                self.mode.append(lily)
+            elif mode == 'schemelily':
+                self.mode.append(schemelily)
+            else:
+                self.mode.append(scheme())
+                self.mode[-1].depth = mode
+        self.indent = list(indents)
+    
+    def lines(self, text, final = True):
+        """
+        Yields the indented lines of text, which must start at the start of
+        a line. (The indent of that line is replaced.)
+        
+        If final is False, the text is continued in a next call, and it must
+        end with a newline. The incomplete attribute is then set to True if
+        the text ended inside a string or block comment, in which case the
+        lines are not correct and should be indented again, together with
+        the text that follows.
+        """
+        mode, indent, makeindent = self.mode, self.indent, self.makeindent
+        indentwidth, tabwidth = self.indentwidth, self.tabwidth
+        self.incomplete = False
+        
+        line = []           # list to build the output, per line
+        curindent = -1      # current indent in count of spaces, -1 : not yet set
+        pos = re.match(r'[^\S\n]*', text).end()
+        
+        # Search the text from the previous position
+        # (very fast: does not alter the string in text)
+        m = mode[-1].search(text, pos)
+        while m:
+            # also append text before the found token
+            more = pos < m.start()
+            if more:
+                line.append(text[pos:m.start()])
+                # an unterminated string or Scheme block comment?
+                if '"' in line[-1] or '#!' in line[-1]:
+                    self.incomplete = True
+            
+            # type, text, and new position for next search
+            item, token, pos = m.lastgroup, m.group(), m.end()
+
+            # If indent not yet determined, set it to 0 if we found a long comment
+            # (with three or more %%% or ;;; characters). Was any other text found,
+            # keep the current indent level for the current line.
+            # (Our current indent can change if our line starts with dedent tokens.)
+            if curindent == -1:
+                if item == 'longcomment':
+                    curindent = 0
+                elif (more or item not in ('dedent', 'space', 'backtoscheme')):
+                    curindent = indent[-1]
+            
+            # Check if we found a multiline block comment.
+            # Thoses are handled specially. Indents inside the block comment are
+            # preserved but positioned as close as possible to the current indent.
+            # So the algorithm cuts the shortest indent off from all lines and then
+            # adds the current indent.
+            if item == 'blockcomment' and '\n' in token:
+                # Find the shortest indent inside the block comment
+                shortest = min(len(n.group(1).expandtabs(tabwidth))
+                    for n in indent_rx.finditer(token))
+                # Remove that indent from all lines
+                fixindent = lambda n: '\n' + makeindent(
+                    curindent - shortest + len(n.group(1).expandtabs(tabwidth)))
+                token = indent_rx.sub(fixindent, token)
+            
+            elif mode[-1] in (lily, schemelily):
+                # we are parsing in LilyPond mode.
+                if item == 'indent':
+                    indent.append(indent[-1] + indentwidth)
+                elif item == 'dedent' and len(indent) > 1:
+                    indent.pop()
+                elif item == 'scheme':
+                    mode.append(scheme())       # enter scheme mode
+                elif item == 'backtoscheme':
+                    indent.pop()
+                    mode.pop()                  # leave lilypond mode, back to scheme
+                elif item == 'comment' and token.startswith('%{'):
+                    self.incomplete = True      # an unterminated block comment
+            else:
+                # we are parsing in Scheme mode.
+                if item == 'indent':
+                    mode[-1].depth += 1         # count parentheses
+                    # look max 10 characters ahead to vertically align opening
+                    # parentheses, but stop at closing parenthesis, quote or newline.
+                    n = re.search(r'[()"\n]', text[pos:pos+10])
+                    if n and n.group() == '(':
+                        indent.append(indent[-1] + n.start() + 1)
+                    else:
+                        indent.append(indent[-1] + indentwidth)
+                    
+                elif item == 'dedent':
+                    if mode[-1].depth:
+                        indent.pop()
+                    if mode[-1].depth <= 1:
+                        mode.pop()              # leave scheme mode
+                    else:
+                        mode[-1].depth -= 1     # count parentheses backwards
+                elif item == 'lilypond':
+                    mode.append(schemelily)     # enter lilypond-in-scheme mode
+                    indent.append(indent[-1] + indentwidth)
+                elif mode[-1].depth == 0:
+                    # jump out if we got one atom or are at a space or end of line
+                    # and still no opening parenthesis. But stay if we only just
+                    # had a hash(#).
+                    if (item in ('string', 'comment', 'longcomment')
+                        or (more and item in ('newline', 'space'))):
+                        mode.pop()
+            
+            # a string whose last quote is escaped was not terminated
+            if (item == 'string' and token.endswith('\\"')
+                and (len(token) - len(token[:-1].rstrip('\\'))) % 2 == 0):
+                self.incomplete = True
+            
+            if item == 'newline':
+                # Write out the line
+                yield makeindent(curindent) + ''.join(line)
+                line = []
+                curindent = -1
+            else:
+                line.append(token)
+            
+            # On to the next token
+            m = mode[-1].search(text, pos)
+        
+        # Still some text left?
+        if pos < len(text):
+            line.append(text[pos:])
+            if '"' in line[-1] or '#!' in line[-1]:
+                self.incomplete = True
+        if line:
+            if curindent == -1:
+                curindent = indent[-1]
+            yield makeindent(curindent) + ''.join(line)
+        elif final:
+            yield makeindent(self.start)
     
+    def stream(self, lines, chunksize = 16384):
+        """
+        Yields the indented lines for an iterable of input lines ending with
+        a newline, such as a file object.
+        
+        The input is indented in chunks of about chunksize characters, so
+        only those (and the input lines that must be indented together, those
+        containing a multi-line string or block comment) are kept in memory.
+        """
+        text, limit = '', chunksize
+        for line in lines:
+            text += line
+            if len(text) < limit or not text.endswith('\n'):
+                continue
+            state = self.freeze()
+            try:
+                result = list(self.lines(text, False))
+            except IndexError:
+                # garbled input, try again together with the following text
+                self.incomplete = True
+            if self.incomplete:
+                self.thaw(state)
+                limit = len(text) + chunksize
+                continue
+            for indented in result:
+                yield indented
+            text, limit = '', chunksize
+        for line in self.lines(text):
+            yield line
+
+
 def indent(text,
         start = None,
         indentwidth = 2,
@@ -97,6 +310,8 @@ def indent(text,
         - True = use tabs for the parts of the indent that exceed the tab width
         - False = don't use tabs.
     startscheme: start in scheme mode (not very robust)
+    
+    See the Indenter class to indent text in pieces.
     """
     
     # record length of indent of first line
@@ -106,125 +321,13 @@ def indent(text,
     if usetabs is None:
         usetabs = '\t' in space or '\n\t' in text
     
-    mode = [lily]       # the mode to parse in
-    indent = [start]    # stack with indent history
-    pos = len(space)    # start position in text
-    output = []         # list of output lines
-    
-    if startscheme:
-        mode.append(scheme())
-    if usetabs:
-        makeindent = lambda i: '\t' * int(i / tabwidth) + ' ' * (i % tabwidth)
-    else:
-        makeindent = lambda i: ' ' * i
-    
-    line = []           # list to build the output, per line
-    curindent = -1      # current indent in count of spaces, -1 : not yet set
-    
-    # Search the text from the previous position
-    # (very fast: does not alter the string in text)
-    m = mode[-1].search(text, pos)
-    while m:
-        # also append text before the found token
-        more = pos < m.start()
-        if more:
-            line.append(text[pos:m.start()])
-        
-        # type, text, and new position for next search
-        item, token, pos = m.lastgroup, m.group(), m.end()
-
-        # If indent not yet determined, set it to 0 if we found a long comment
-        # (with three or more %%% or ;;; characters). Was any other text found,
-        # keep the current indent level for the current line.
-        # (Our current indent can change if our line starts with dedent tokens.)
-        if curindent == -1:
-            if item == 'longcomment':
-                curindent = 0
-            elif (more or item not in ('dedent', 'space', 'backtoscheme')):
-                curindent = indent[-1]
-        
-        # Check if we found a multiline block comment.
-        # Thoses are handled specially. Indents inside the block comment are
-        # preserved but positioned as close as possible to the current indent.
-        # So the algorithm cuts the shortest indent off from all lines and then
-        # adds the current indent.
-        if item == 'blockcomment' and '\n' in token:
-            # Find the shortest indent inside the block comment
-            shortest = min(len(n.group(1).expandtabs(tabwidth))
-                for n in indent_rx.finditer(token))
-            # Remove that indent from all lines
-            fixindent = lambda n: '\n' + makeindent(
-                curindent - shortest + len(n.group(1).expandtabs(tabwidth)))
-            token = indent_rx.sub(fixindent, token)
-        
-        elif mode[-1] in (lily, schemelily):
-            # we are parsing in LilyPond mode.
-            if item == 'indent':
-                indent.append(indent[-1] + indentwidth)
-            elif item == 'dedent' and len(indent) > 1:
-                indent.pop()
-            elif item == 'scheme':
-                mode.append(scheme())       # enter scheme mode
-            elif item == 'backtoscheme':
-                indent.pop()
-                mode.pop()                  # leave lilypond mode, back to scheme
-        else:
-            # we are parsing in Scheme mode.
-            if item == 'indent':
-                mode[-1].depth += 1         # count parentheses
-                # look max 10 characters ahead to vertically align opening
-                # parentheses, but stop at closing parenthesis, quote or newline.
-                n = re.search(r'[()"\n]', text[pos:pos+10])
-                if n and n.group() == '(':
-                    indent.append(indent[-1] + n.start() + 1)
-                else:
-                    indent.append(indent[-1] + indentwidth)
-                
-            elif item == 'dedent':
-                if mode[-1].depth:
-                    indent.pop()
-                if mode[-1].depth <= 1:
-                    mode.pop()              # leave scheme mode
-                else:
-                    mode[-1].depth -= 1     # count parentheses backwards
-            elif item == 'lilypond':
-                mode.append(schemelily)     # enter lilypond-in-scheme mode
-                indent.append(indent[-1] + indentwidth)
-            elif mode[-1].depth == 0:
-                # jump out if we got one atom or are at a space or end of line
-                # and still no opening parenthesis. But stay if we only just
-                # had a hash(#).
-                if (item in ('string', 'comment', 'longcomment')
-                    or (more and item in ('newline', 'space'))):
-                    mode.pop()
-        
-        if item == 'newline':
-            # Write out the line
-            output.append(makeindent(curindent) + ''.join(line))
-            line = []
-            curindent = -1
-        else:
-            line.append(token)
-        
-        # On to the next token
-        m = mode[-1].search(text, pos)
-    
-    # Still some text left?
-    if pos < len(text):
-        line.append(text[pos:])
-    if line:
-        if curindent == -1:
-            curindent = indent[-1]
-        output.append(makeindent(curindent) + ''.join(line))
-    else:
-        output.append(makeindent(start))
-    # Return formatted output
-    return '\n'.join(output)
+    indenter = Indenter(start, indentwidth, tabwidth, usetabs, startscheme)
+    return '\n'.join(indenter.lines(text))
 
     
 if __name__ == '__main__':
     
-    import sys, optparse
+    import codecs, sys, optparse
     
     op = optparse.OptionParser(usage='usage: %prog [options] [filename]')
     op.add_option('-o', '--output',
@@ -239,20 +342,37 @@ if __name__ == '__main__':
         help='start indenting in Scheme mode')
     op.add_option('-u', '--use-tabs', action='store_true',
         help='use tabs instead of spaces for indent')
+    op.add_option('--stream', action='store_true',
+        help='indent line by line, without reading all input in memory')
+    op.add_option('-e', '--encoding', default='utf-8',
+        help='encoding of the input and output [default: %default]')
     options, args = op.parse_args()
-    # TODO: encoding
     # TODO: error handling
-    infile = args and open(args[0]) or sys.stdin
-    text = infile.read()
-    text = indent(text,
-        start=options.start_indent,
-        indentwidth=options.indent_width,
-        tabwidth=options.tab_width,
-        usetabs=options.use_tabs,
-        startscheme=options.scheme
-        )
-    outfile = options.output and (options.output) or sys.stdout
-    outfile.write(text)
+    infile = args and open(args[0], 'rb') or sys.stdin
+    outfile = options.output and open(options.output, 'wb') or sys.stdout
+    reader = codecs.getreader(options.encoding)(infile)
+    writer = codecs.getwriter(options.encoding)(outfile)
+    if options.stream:
+        lines = Indenter(
+            start=options.start_indent,
+            indentwidth=options.indent_width,
+            tabwidth=options.tab_width,
+            usetabs=options.use_tabs,
+            startscheme=options.scheme
+            ).stream(reader)
+        writer.write(next(lines))
+        for line in lines:
+            writer.write('\n' + line)
+    else:
+        text = reader.read()
+        text = indent(text,
+            start=options.start_indent,
+            indentwidth=options.indent_width,
+            tabwidth=options.tab_width,
+            usetabs=options.use_tabs,
+            startscheme=options.scheme
+            )
+        writer.write(text)
     
     if infile is not sys.stdin:
         infile.close()
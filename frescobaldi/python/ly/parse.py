@@ -27,34 +27,149 @@ import os
 import ly.rx
 
 
-def findIncludeFiles(lyfile, path=()):
-    """Finds files included by the document in lyfile.
+class IncludeGraph(object):
+    """Caches the files included by LilyPond files.
     
-    If path is given, it must be a list of directories that are also searched
-    for files to be included.
+    For every file that is read, the include statements are stored together
+    with the modification time and size of the file. The file is only read
+    again if one of those changes.
+    
+    If filename is given, the cache is loaded from that file, and save() will
+    write it back there.
     
     """
-    files = set()
-    basedir = os.path.dirname(lyfile)
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._files = {}    # path -> (mtime, size, tuple of includes)
+        self._changed = False
+        self.hits = 0
+        self.misses = 0
+        if filename:
+            self.load(filename)
     
-    def find(lyfile):
-        if os.access(lyfile, os.R_OK):
+    def includes(self, lyfile):
+        """Returns the names of the files lyfile includes (as written).
+        
+        Returns None if the file can't be read.
+        
+        """
+        if not os.access(lyfile, os.R_OK):
+            return None
+        path = os.path.abspath(lyfile)
+        try:
+            s = os.stat(path)
+        except OSError:
+            return None
+        try:
+            mtime, size, includes = self._files[path]
+        except KeyError:
+            pass
+        else:
+            if (mtime, size) == (s.st_mtime, s.st_size):
+                self.hits += 1
+                return includes
+        self.misses += 1
+        try:
+            with open(path) as f:
+                text = f.read().decode('utf-8', 'ignore')
+        except IOError:
+            return None
+        # delete the comments
+        text = ly.rx.all_comments.sub('', text)
+        includes = tuple(ly.rx.include_file.findall(text))
+        self._files[path] = (s.st_mtime, s.st_size, includes)
+        self._changed = True
+        return includes
+        
+    def find(self, lyfile, path=()):
+        """Finds files included by the document in lyfile.
+        
+        Returns a set containing lyfile and all files it (recursively)
+        includes. Every file is looked at once, so files including each
+        other are handled fine.
+        
+        If path is given, it must be a list of directories that are also
+        searched for files to be included.
+        
+        """
+        files = set()
+        basedir = os.path.dirname(lyfile)
+        pending = [lyfile]
+        while pending:
+            lyfile = os.path.normpath(pending.pop())
+            if lyfile in files:
+                continue
+            includes = self.includes(lyfile)
+            if includes is None:
+                continue
             files.add(lyfile)
             directory = os.path.dirname(lyfile)
-            # read the file and delete the comments.
-            with open(lyfile) as f:
-                text = ly.rx.all_comments.sub('', f.read().decode('utf-8', 'ignore'))
-            for f in ly.rx.include_file.findall(text):
+            for f in includes:
                 # old include (relative to master file)
-                find(os.path.join(basedir, f))
+                pending.append(os.path.join(basedir, f))
                 # new, recursive, relative include
                 if directory != basedir:
-                    find(os.path.join(directory, f))
+                    pending.append(os.path.join(directory, f))
                 # if path is given, also search there:
                 for p in path:
-                    find(os.path.join(p, f))
-    find(lyfile)
-    return files
+                    pending.append(os.path.join(p, f))
+        return files
+    
+    def clear(self):
+        """Forgets all cached files."""
+        if self._files:
+            self._files.clear()
+            self._changed = True
+        
+    def load(self, filename):
+        """Loads the cache from a file written by save().
+        
+        A missing or unreadable file is silently ignored.
+        
+        """
+        import cPickle
+        try:
+            with open(filename, 'rb') as f:
+                files = cPickle.load(f)
+        except Exception:
+            return
+        if isinstance(files, dict):
+            self._files.update(files)
+    
+    def save(self, filename=None):
+        """Writes the cache to filename (default: the filename given on init).
+        
+        Does nothing if nothing was changed since the last save().
+        
+        """
+        filename = filename or self.filename
+        if not filename or not self._changed:
+            return
+        import cPickle
+        # remove the entries of files that do not exist anymore
+        for path in [p for p in self._files if not os.path.exists(p)]:
+            del self._files[path]
+        temp = filename + '.tmp'
+        try:
+            with open(temp, 'wb') as f:
+                cPickle.dump(self._files, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp, filename)
+        except (IOError, OSError):
+            return
+        self._changed = False
+
+
+# the IncludeGraph used by findIncludeFiles()
+includeGraph = IncludeGraph()
+
+def findIncludeFiles(lyfile, path=()):
+    """Finds files included by the document in lyfile.
+    
+    If path is given, it must be a list of directories that are also searched
+    for files to be included.
+    
+    """
+    return includeGraph.find(lyfile, path)
 
 def documentLanguage(text):
     """Return the LilyPond pitch language name for the document, if set."""
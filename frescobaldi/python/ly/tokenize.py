@@ -30,7 +30,7 @@ Usage:
 >>> for token in tokenizer.tokens(lilypond):
 ...  print token.__class__.__name__, repr(token)
 ...
-Command u'\\relative'
+Relative u'\\relative'
 Space u' '
 PitchWord u'c'
 Unparsed u"'"
@@ -78,7 +78,9 @@ text for the list of tokens returned by its items() method. You can also easily
 subclass the Parser classes.
 """
 
+import bisect
 import re
+from array import array
 import ly.rx
 import ly.pitch
 import ly.words
@@ -121,6 +123,8 @@ class _tokenizer_meta(type):
                     attr.pattern = pattern
                 elif attr.pattern.pattern != pattern.pattern:
                     setattr(cls, name, type(name, (attr,), {'pattern': pattern}))
+        # dispatch tables per Parser class, built by dispatch() when needed
+        cls._dispatch = {}
 
 
 class Tokenizer(object):
@@ -200,6 +204,29 @@ class Tokenizer(object):
         """
         return len(self.state), self.state[-1].level
 
+    @classmethod
+    def dispatch(cls, parserClass):
+        """
+        Return the dispatch table for the pattern of the given Parser class.
+        
+        The table is a list, indexed by the number of the regex group that
+        matched (the lastindex of the match object), of (tokenClass, action)
+        tuples. The action is None if the token does not change the state of
+        the tokenizer, a Tokenizer method if only that method needs to be
+        called, or True if the token must be instantiated to change the state.
+        
+        """
+        try:
+            return cls._dispatch[parserClass]
+        except KeyError:
+            pattern = parserClass.pattern
+            table = [None] * (pattern.groups + 1)
+            for tokenClass in parserClass.items(cls):
+                table[pattern.groupindex[tokenClass.__name__]] = (
+                    tokenClass, _action(cls, tokenClass))
+            cls._dispatch[parserClass] = table
+            return table
+    
     def tokens(self, text, pos = 0):
         """Iterate over the LilyPond tokens in the string.
         
@@ -212,17 +239,52 @@ class Tokenizer(object):
         "LilyPond in Scheme" (the #{ and #} constructs).
         
         """
-        m = self.parser().parse(text, pos)
-        while m:
+        parser = None
+        while True:
+            if self.state[-1] is not parser:
+                parser = self.state[-1]
+                table = self.dispatch(parser.__class__)
+            m = parser.parse(text, pos)
+            if not m:
+                break
             if pos < m.start():
                 yield self.Unparsed(text[pos:m.start()], pos)
-            tokenClass = getattr(self, m.lastgroup)
-            yield tokenClass(m, self)
+            yield table[m.lastindex][0](m, self)
             pos = m.end()
-            m = self.parser().parse(text, pos)
         if pos < len(text):
             yield self.Unparsed(text[pos:], pos)
     
+    def spans(self, text, pos = 0):
+        """Iterate over (tokenClass, start, end) tuples for the tokens in text.
+        
+        The same tokens are found as with tokens() and the state of the
+        tokenizer is changed in the same way, but no token objects are created
+        (except for the few tokens that need themselves to change the state,
+        like those entering another parser). Use this when only the type and
+        the place of the tokens are needed, e.g. for highlighting.
+        
+        """
+        parser = None
+        while True:
+            if self.state[-1] is not parser:
+                parser = self.state[-1]
+                table = self.dispatch(parser.__class__)
+            m = parser.parse(text, pos)
+            if not m:
+                break
+            start, end = m.span()
+            if pos < start:
+                yield self.Unparsed, pos, start
+            tokenClass, action = table[m.lastindex]
+            if action is True:
+                tokenClass(m, self)
+            elif action:
+                action(self)
+            yield tokenClass, start, end
+            pos = end
+        if pos < len(text):
+            yield self.Unparsed, pos, len(text)
+    
     def freeze(self):
         """
         Returns the frozen state of this tokenizer as an immutable tuple
@@ -239,11 +301,14 @@ class Tokenizer(object):
         """
         Accepts a tuple such as returned by freeze(), and restores
         the state of this tokenizer from it.
+        
+        The Parser classes are looked up by name in this tokenizer, so a
+        state frozen by another Tokenizer (sub)class can also be used.
         """
         state, self.language = frozenState
         self.state = []
         for cls, token, level, argcount in state:
-            parser = cls(token, argcount)
+            parser = getattr(self, cls.__name__, cls)(token, argcount)
             parser.level = level
             self.state.append(parser)
     
@@ -431,6 +496,11 @@ class Tokenizer(object):
         def __init__(self, matchObj, tokenizer):
             tokenizer.enter(tokenizer.MarkupParser, self)
     
+    class Relative(Command):
+        rx = r"\\relative\b"
+        def __init__(self, matchObj, tokenizer):
+            tokenizer.enter(tokenizer.RelativeParser, self)
+
     class Language(Command):
         rx = r"\\language\b"
         def __init__(self, matchObj, tokenizer):
@@ -462,6 +532,15 @@ class Tokenizer(object):
     class CloseDelimiter(Decreaser):
         rx = r">>|\}"
 
+    class RelativeEnd(CloseDelimiter):
+        """ Closes a music expression, ending \\relative if it was its music. """
+        def __init__(self, matchObj, tokenizer):
+            tokenizer.dec()
+            if (isinstance(tokenizer.parser(), tokenizer.RelativeParser)
+                and tokenizer.parser().level == 0):
+                tokenizer.leave()
+                tokenizer.endArgument()
+
     class Dynamic(Token):
         rx = r"\\[<>!]"
 
@@ -586,6 +665,7 @@ class Tokenizer(object):
         cls.ChordMode,
         cls.FigureMode,
         cls.NoteMode,
+        cls.Relative,
         cls.Markup,
         cls.MarkupLines,
         cls.Include,
@@ -652,6 +732,18 @@ class Tokenizer(object):
     class NoteModeParser(ToplevelParser, InputModeParser):
         argcount = 1
 
+    class RelativeParser(ToplevelParser):
+        """
+        The start pitch and the music of a \\relative command. As the pitch is
+        optional and commands like \\new Staff may come before the music, the
+        parser is not left after a number of arguments, but when the first
+        music expression is closed.
+        """
+        argcount = 0
+        items = staticmethod(lambda cls: (
+            cls.RelativeEnd,
+        ) + cls.ToplevelParser.items(cls))
+
     class SectionParser(Parser):
         argcount = 1
         items = staticmethod(lambda cls: (
@@ -681,6 +773,30 @@ class Tokenizer(object):
         ) + cls.lilybaseItems())
         
 
+def _action(tokenizerClass, tokenClass):
+    """(Internal) Return the action for a token class in a dispatch table.
+    
+    Looks for the class that defines the constructor of the token class.
+    The constructors of the basic Item, Increaser, Decreaser and Leaver
+    classes just call one Tokenizer method, which is returned instead.
+    
+    """
+    for cls in tokenClass.__mro__:
+        if '__init__' in cls.__dict__:
+            break
+    if cls is object:
+        return None
+    for base, method in (
+            (Tokenizer.Item, 'endArgument'),
+            (Tokenizer.Increaser, 'inc'),
+            (Tokenizer.Decreaser, 'dec'),
+            (Tokenizer.Leaver, 'leave'),
+            ):
+        if cls is base:
+            return getattr(tokenizerClass, method)
+    return True
+
+
 class MusicTokenizer(Tokenizer):
     """
     A Tokenizer more directed to parsing music.
@@ -725,14 +841,10 @@ class LineColumnMixin(object):
     to every token.
     """
     def tokens(self, text, pos = 0):
-        cursor = Cursor()
-        if pos:
-            cursor.walk(text[:pos])
+        lineIndex = LineIndex(text)
         for token in super(LineColumnMixin, self).tokens(text, pos):
-            token.line = cursor.line
-            token.column = cursor.column
+            token.line, token.column = lineIndex.position(token.pos)
             yield token
-            cursor.walk(token)
 
 
 class LineColumnTokenizer(LineColumnMixin, Tokenizer):
@@ -743,6 +855,341 @@ class LineColumnTokenizer(LineColumnMixin, Tokenizer):
     pass
 
 
+class IncrementalTokenizer(object):
+    """
+    Keeps the frozen state of a Tokenizer at regular checkpoints in a text,
+    so that the text need not be tokenized from the start again and again.
+
+    Checkpoints are placed at the end of tokens containing a newline, about
+    every interval characters. When the text is changed using replace(), only
+    the checkpoints after the change are invalidated. Tokenizing resumes from
+    the nearest valid checkpoint, and as soon as it arrives at an old
+    checkpoint (shifted by the change) with the same state, all old
+    checkpoints after it are taken over again.
+
+    The tokenizer given to tokens() must use the same Parser classes as the
+    tokenizerClass this object was created with (subclasses that only mix in
+    other behaviour, like LineColumnTokenizer, are fine).
+
+    The hits and misses attributes count the calls to tokens() that could
+    start at a valid checkpoint right away and those that first needed to
+    tokenize text to create checkpoints.
+    """
+    def __init__(self, tokenizerClass = Tokenizer, text = "", interval = 2048):
+        self.tokenizerClass = tokenizerClass
+        self.interval = interval
+        self.hits = 0
+        self.misses = 0
+        self.setText(text)
+
+    def setText(self, text):
+        """ Set a new text, forgetting all checkpoints. """
+        self._text = text
+        self._positions = [0]
+        self._states = [self.tokenizerClass().freeze()]
+        self._upto = 0
+        # invalidated checkpoints, as a list of [checkpoints, upto] segments.
+        # The checkpoints of a segment are valid again (until upto) as soon
+        # as one of them is reached with the same state.
+        self._pending = []
+
+    def text(self):
+        """ Return the current text. """
+        return self._text
+
+    def replace(self, pos, end, text):
+        """ Replace the slice pos:end of our text with text. """
+        self._text = self._text[:pos] + text + self._text[end:]
+        self.invalidate(pos, end - pos, len(text))
+
+    def invalidate(self, pos, removed = 0, added = 0):
+        """
+        Invalidate checkpoints because at pos removed characters were
+        replaced with added characters. The text must already be updated.
+        (Use this directly if you maintain the text via setText() yourself.)
+        """
+        delta = added - removed
+        edit = pos + removed
+        index = max(1, bisect.bisect_left(self._positions, pos))
+        segments = [[zip(self._positions[index:], self._states[index:]),
+                     self._upto]] + self._pending
+        self._pending = []
+        for checkpoints, upto in segments:
+            before = [c for c in checkpoints if c[0] < pos]
+            if before:
+                self._pending.append([before, min(upto, pos)])
+            if upto >= edit:
+                after = [(p + delta, s) for p, s in checkpoints if p >= edit]
+                if after:
+                    self._pending.append([after, upto + delta])
+        del self._positions[index:], self._states[index:]
+        self._upto = self._positions[-1]
+
+    def checkpoints(self):
+        """ Return the number of valid checkpoints. """
+        return len(self._positions)
+
+    def _resync(self, end, tokenizer):
+        """
+        (Internal) Called at the end of every token containing a newline.
+        Takes over invalidated checkpoints if they turn out to be valid again,
+        in which case True is returned.
+        """
+        pending = self._pending
+        while pending and pending[0][0][0][0] < end:
+            del pending[0][0][0]
+            if not pending[0][0]:
+                del pending[0]
+        if (pending and pending[0][0][0][0] == end
+                and pending[0][0][0][1] == tokenizer.freeze()):
+            checkpoints, upto = pending.pop(0)
+            self._positions.extend(p for p, s in checkpoints)
+            self._states.extend(s for p, s in checkpoints)
+            self._upto = max(end, upto)
+            return True
+
+    def _extend(self, pos):
+        """ (Internal) Create checkpoints until at least pos. """
+        while self._upto < pos and self._upto < len(self._text):
+            tokenizer = self.tokenizerClass()
+            tokenizer.thaw(self._states[-1])
+            text = self._text
+            for tokenClass, start, end in tokenizer.spans(
+                    text, self._positions[-1]):
+                if text.find('\n', start, end) == -1:
+                    continue
+                if self._resync(end, tokenizer):
+                    break # back in sync, continue at the last checkpoint
+                if end - self._positions[-1] >= self.interval:
+                    self._positions.append(end)
+                    self._states.append(tokenizer.freeze())
+                self._upto = end
+                if end >= pos:
+                    return
+            else:
+                self._upto = len(self._text)
+                self._pending = []
+
+    def tokens(self, tokenizer = None, pos = 0, end = None):
+        """
+        Iterate over the tokens of our text that end after pos, tokenizing
+        from the nearest checkpoint before pos.
+
+        If end is given, the text is tokenized as if it ended there.
+        The tokenizer (if given) is put in the state of the checkpoint and
+        then used, so its state can be inspected while iterating.
+        """
+        if tokenizer is None:
+            tokenizer = self.tokenizerClass()
+        start = self._checkpoint(tokenizer, pos)
+        text = self._text if end is None else self._text[:end]
+        for token in tokenizer.tokens(text, start):
+            if token.end > pos:
+                yield token
+
+    def _checkpoint(self, tokenizer, pos):
+        """
+        (Internal) Put the tokenizer in the state of the nearest checkpoint
+        before pos and return the position of that checkpoint.
+        """
+        if pos <= self._upto:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._extend(pos)
+        index = bisect.bisect_right(self._positions, pos) - 1
+        tokenizer.thaw(self._states[index])
+        return self._positions[index]
+
+    def tokenizer(self, pos):
+        """ Return a tokenizer in the state it has at offset pos. """
+        tokenizer = self.tokenizerClass()
+        start = self._checkpoint(tokenizer, pos)
+        for span in tokenizer.spans(self._text[:pos], start):
+            pass
+        return tokenizer
+
+    def state(self, pos):
+        """ Return the frozen state of the tokenizer at offset pos. """
+        return self.tokenizer(pos).freeze()
+
+
+class TokenArray(object):
+    """
+    A compact representation of the tokens in a (large) text.
+
+    Instead of token objects, only the kind (an index in the kinds list,
+    which contains the token classes), the start and the end of each token
+    are stored, in three parallel integer arrays. Line and column numbers are
+    computed when asked for.
+
+    Indexing yields (tokenClass, start, end) tuples, just like
+    Tokenizer.spans(), and so does iterating. Slicing returns a TokenArray
+    for the selected tokens, that shares the arrays and the text with the
+    original. The text of a token is only taken from the text when text()
+    is called.
+
+    The tokenizer attribute keeps the tokenizer, in the state it has at the
+    end of the text.
+    """
+    def __init__(self, text, tokenizer = None, pos = 0):
+        if tokenizer is None:
+            tokenizer = Tokenizer()
+        self.tokenizer = tokenizer
+        self.kinds = []
+        self._text = text
+        self._kind = array(b'i')
+        self._start = array(b'i')
+        self._end = array(b'i')
+        self._first = 0
+        self._last = 0
+        self._lineIndex = [None] # shared with slices
+        ids = {}
+        kinds, starts, ends = self._kind.append, self._start.append, self._end.append
+        for tokenClass, start, end in tokenizer.spans(text, pos):
+            try:
+                kind = ids[tokenClass]
+            except KeyError:
+                kind = ids[tokenClass] = len(self.kinds)
+                self.kinds.append(tokenClass)
+            kinds(kind)
+            starts(start)
+            ends(end)
+        self._last = len(self._kind)
+
+    def __len__(self):
+        return self._last - self._first
+
+    def _index(self, index):
+        """ (Internal) Return the index in our arrays. """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TokenArray index out of range")
+        return self._first + index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            first, last, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("TokenArray slices must be contiguous")
+            view = object.__new__(self.__class__)
+            view.__dict__.update(self.__dict__)
+            view._first = self._first + first
+            view._last = self._first + max(first, last)
+            return view
+        i = self._index(index)
+        return self.kinds[self._kind[i]], self._start[i], self._end[i]
+
+    def __iter__(self):
+        kinds, kind, start, end = self.kinds, self._kind, self._start, self._end
+        for i in xrange(self._first, self._last):
+            yield kinds[kind[i]], start[i], end[i]
+
+    def kind(self, index):
+        """ Return the token class of the token at index. """
+        return self.kinds[self._kind[self._index(index)]]
+
+    def pos(self, index):
+        """ Return the start position of the token at index. """
+        return self._start[self._index(index)]
+
+    def end(self, index):
+        """ Return the end position of the token at index. """
+        return self._end[self._index(index)]
+
+    def text(self, index = None):
+        """
+        Return the text of the token at index, or, if index is None,
+        the text of all our tokens.
+        """
+        if index is None:
+            if self._first == self._last:
+                return ""
+            return self._text[self._start[self._first]:self._end[self._last-1]]
+        i = self._index(index)
+        return self._text[self._start[i]:self._end[i]]
+
+    def find(self, pos):
+        """
+        Return the index of the token at position pos (i.e. the first token
+        that ends after pos), or len(self) if there is none.
+        """
+        i = bisect.bisect_right(self._end, pos, self._first, self._last)
+        return i - self._first
+
+    def indices(self, *classes):
+        """ Iterate over the indices of the tokens of the given classes. """
+        wanted = array(b'b', (issubclass(cls, classes) for cls in self.kinds))
+        kind = self._kind
+        for i in xrange(self._first, self._last):
+            if wanted[kind[i]]:
+                yield i - self._first
+
+    def lineIndex(self):
+        """ Return a LineIndex for our text, created on first use. """
+        if self._lineIndex[0] is None:
+            self._lineIndex[0] = LineIndex(self._text)
+        return self._lineIndex[0]
+
+    def line(self, index):
+        """ Return the line number (starting with 0) of the token at index. """
+        return self.lineIndex().line(self._start[self._index(index)])
+
+    def column(self, index):
+        """ Return the column of the start of the token at index. """
+        return self.lineIndex().position(self._start[self._index(index)])[1]
+
+
+class LineIndex(object):
+    """
+    Knows the positions of all newlines in a text, to quickly translate
+    positions in the text to line and column numbers and back.
+
+    Line and column numbers start with 0. The text must not be changed;
+    create a new LineIndex for a changed text.
+    """
+    def __init__(self, text):
+        self._text = text
+        self._newlines = array(b'i',
+            (m.start() for m in re.finditer('\n', text)))
+
+    def lines(self):
+        """ Return the number of lines. """
+        return len(self._newlines) + 1
+
+    def line(self, pos):
+        """ Return the number of the line position pos is in. """
+        return bisect.bisect_left(self._newlines, pos)
+
+    def lineStart(self, line):
+        """ Return the position of the start of the line. """
+        return self._newlines[line - 1] + 1 if line else 0
+
+    def lineEnd(self, line):
+        """ Return the position of the end of the line (before the newline). """
+        if line < len(self._newlines):
+            return self._newlines[line]
+        return len(self._text)
+
+    def position(self, pos):
+        """ Return a two-tuple (line, column) for the position in the text. """
+        line = bisect.bisect_left(self._newlines, pos)
+        return line, pos - self.lineStart(line)
+
+    def offset(self, line, column):
+        """
+        Return the position in the text of line and column.
+        Returns -1 if the position falls outside the text.
+        """
+        if not 0 <= line < self.lines():
+            return -1
+        pos = self.lineStart(line) + column
+        if pos > self.lineEnd(line):
+            return -1
+        return pos
+
+
 class Cursor(object):
     """
     A Cursor instance can walk() over any piece of plain text,
@@ -784,6 +1231,33 @@ class Cursor(object):
             self.anchorLine = self.line
             self.anchorColumn = self.column + len(text)
 
+    def move(self, lineIndex, pos, end):
+        """
+        Does the same as walk(text[pos:end]), where lineIndex is a LineIndex
+        for text, but without looking at the text in between.
+        """
+        line, column = lineIndex.position(pos)
+        endLine, endColumn = lineIndex.position(end)
+        if endLine > line:
+            self.line += endLine - line
+            self.column = endColumn
+        else:
+            self.column += endColumn - column
+
+    def anchorAt(self, lineIndex, pos, end):
+        """
+        Does the same as anchor(text[pos:end]), where lineIndex is a
+        LineIndex for text, but without looking at the text in between.
+        """
+        line, column = lineIndex.position(pos)
+        endLine, endColumn = lineIndex.position(end)
+        if endLine > line:
+            self.anchorLine = self.line + endLine - line
+            self.anchorColumn = endColumn
+        else:
+            self.anchorLine = self.line
+            self.anchorColumn = self.column + endColumn - column
+
     def __enter__(self):
         """ Called before edits are made. """
         pass
@@ -818,6 +1292,9 @@ class ChangeList(object):
     # If False, the user must add the changes in the correct order!
     sortItems = True
     
+    # the number of tokens looked at to create the changes (see ly.tools)
+    scanned = 0
+    
     def __init__(self, text):
         self._changes = []
         self._text = text
@@ -867,13 +1344,14 @@ class ChangeList(object):
         return ''.join(parts())
 
     def applyToCursor(self, cursor):
+        lineIndex = LineIndex(self._text)
         index = 0
         with cursor:
             for pos, end, text in self.changes():
                 if pos > index:
-                    cursor.walk(self._text[index:pos])
+                    cursor.move(lineIndex, index, pos)
                 if end > pos:
-                    cursor.anchor(self._text[pos:end])
+                    cursor.anchorAt(lineIndex, pos, end)
                     if text:
                         cursor.replaceText(text)
                         cursor.walk(text)
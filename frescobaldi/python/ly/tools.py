@@ -41,24 +41,42 @@ class Pitch(ly.pitch.Pitch):
             return p
     
 
-def relativeToAbsolute(text, start = 0, changes = None):
+def scan(tokenizer, text, pos = 0, changes = None):
+    """
+    Yields the tokens of text from pos.
+    If changes (a ChangeList) is given, its scanned attribute counts the
+    tokens.
+    """
+    for token in tokenizer.tokens(text, pos):
+        if changes is not None:
+            changes.scanned += 1
+        yield token
+
+
+def relativeToAbsolute(text, start = 0, changes = None,
+        tokenizer = None):
     """
     Convert \relative { }  music to absolute pitches.
     Returns a ChangeList instance that contains the changes.
-    """
-    tokenizer = ly.tokenize.MusicTokenizer()
-    tokens = tokenizer.tokens(text)
-    
-    # Walk through not-selected text, to track the state and the 
-    # current pitch language.
-    if start:
-        for token in tokens:
-            if token.end >= start:
-                break
     
+    If tokenizer is given, it must be in the state it has at start (e.g. thawed
+    from a saved state), and the text before start is not looked at.
+    """
     if changes is None:
         changes = ly.tokenize.ChangeList(text)
     
+    if tokenizer is None:
+        tokenizer = ly.tokenize.MusicTokenizer()
+        tokens = scan(tokenizer, text, 0, changes)
+        # Walk through not-selected text, to track the state and the 
+        # current pitch language.
+        if start:
+            for token in tokens:
+                if token.end >= start:
+                    break
+    else:
+        tokens = scan(tokenizer, text, start, changes)
+    
     def newPitch(token, pitch, lastPitch):
         """
         Writes a new pitch with all parts except the octave taken from the
@@ -190,23 +208,29 @@ def relativeToAbsolute(text, start = 0, changes = None):
         pass
     return changes
 
-def absoluteToRelative(text, start = 0, changes = None):
+def absoluteToRelative(text, start = 0, changes = None,
+        tokenizer = None):
     """
     Converts the selected music expression or all toplevel expressions to \relative ones.
-    """
-    tokenizer = ly.tokenize.MusicTokenizer()
-    tokens = tokenizer.tokens(text)
-    
-    # Walk through not-selected text, to track the state and the 
-    # current pitch language.
-    if start:
-        for token in tokens:
-            if token.end >= start:
-                break
     
+    If tokenizer is given, it must be in the state it has at start (e.g. thawed
+    from a saved state), and the text before start is not looked at.
+    """
     if changes is None:
         changes = ly.tokenize.ChangeList(text)
     
+    if tokenizer is None:
+        tokenizer = ly.tokenize.MusicTokenizer()
+        tokens = scan(tokenizer, text, 0, changes)
+        # Walk through not-selected text, to track the state and the 
+        # current pitch language.
+        if start:
+            for token in tokens:
+                if token.end >= start:
+                    break
+    else:
+        tokens = scan(tokenizer, text, start, changes)
+    
     def newPitch(token, pitch):
         """
         Writes a new pitch with all parts except the octave taken from the
@@ -331,18 +355,35 @@ def languageAndKey(text):
                     keyPitch.octave = 0
     return tokenizer.language, keyPitch
 
-def transpose(text, transposer, start = 0, changes = None):
+def inPitchContext(tokenizer):
+    """
+    Returns True if the tokenizer is inside \\relative or \\chordmode music,
+    where the meaning of a pitch depends on the text before it.
+    """
+    return any(isinstance(parser, (tokenizer.RelativeParser,
+        tokenizer.ChordModeParser)) for parser in tokenizer.state)
+
+def transpose(text, transposer, start = 0, changes = None,
+        tokenizer = None):
     """
     Transpose all or selected pitches.
     Raises ly.QuarterToneAlterationNotAvailable if quarter tones are
     requested but not available in the current language.
-    """
-    tokenizer = ly.tokenize.MusicTokenizer()
-    tokens = tokenizer.tokens(text)
     
+    If tokenizer is given, it must be in the state it has at start (e.g. thawed
+    from a saved state), and the text before start is not looked at.
+    """
     if changes is None:
         changes = ly.tokenize.ChangeList(text)
     
+    # The pitches in the selection may depend on an enclosing \relative or
+    # \chordmode expression, which must then be read from the start.
+    if tokenizer is None or inPitchContext(tokenizer):
+        tokenizer = ly.tokenize.MusicTokenizer()
+        tokens = scan(tokenizer, text, 0, changes)
+    else:
+        tokens = scan(tokenizer, text, start, changes)
+    
     class gen(object):
         """
         Advanced generator of tokens, discarding whitespace and comments,
@@ -525,24 +566,30 @@ def transpose(text, transposer, start = 0, changes = None):
     absolute(source)
     return changes
 
-def translate(text, lang, start = 0, changes = None):
+def translate(text, lang, start = 0, changes = None,
+        tokenizer = None):
     """
     Change the LilyPond pitch name language in our document to lang.
     Raises ly.QuarterToneAlterationNotAvailable if quarter tones are
     requested but not available in the target language.
-    """
-    tokenizer = ly.tokenize.Tokenizer()
-    tokens = tokenizer.tokens(text)
-    
-    # Walk through not-selected text, to track the state and the 
-    # current pitch language.
-    if start:
-        for token in tokens:
-            if token.end >= start:
-                break
     
+    If tokenizer is given, it must be in the state it has at start (e.g. thawed
+    from a saved state), and the text before start is not looked at.
+    """
     if changes is None:
         changes = ly.tokenize.ChangeList(text)
+    
+    if tokenizer is None:
+        tokenizer = ly.tokenize.Tokenizer()
+        tokens = scan(tokenizer, text, 0, changes)
+        # Walk through not-selected text, to track the state and the 
+        # current pitch language.
+        if start:
+            for token in tokens:
+                if token.end >= start:
+                    break
+    else:
+        tokens = scan(tokenizer, text, start, changes)
 
     writer = ly.pitch.pitchWriter[lang]
     reader = ly.pitch.pitchReader[tokenizer.language]
@@ -0,0 +1,274 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+"""
+Split a LilyPond document in parts that can be compiled separately.
+
+Every toplevel \\score or \\bookpart block is a unit. A unit is compiled from
+a copy of the document in which all other units are blanked out, so it
+shares everything else (the \\header, \\paper, variables and includes) with
+the document. Because the line numbers stay the same and the copy tells
+LilyPond the name of the original file, point and click and the messages of
+LilyPond still refer to the document.
+
+The PDF files of the units are combined afterwards. Every unit starts on a
+new page; the page numbers continue from the previous unit.
+"""
+
+import os, re, shutil, subprocess
+
+import ly.tokenize
+
+
+# commands that may appear at toplevel without creating output
+_safeCommands = frozenset((
+    '\\version', '\\pointAndClickOn', '\\pointAndClickOff',
+    '\\sourcefilename', '\\sourcefileline',
+))
+
+# the command to combine PDF files
+combineCommand = [
+    'gs', '-q', '-dNOPAUSE', '-dBATCH', '-dSAFER', '-sDEVICE=pdfwrite',
+]
+
+
+class Unit(object):
+    """A toplevel \\score or \\bookpart block.
+
+    kind is "score" or "bookpart", start and end are the positions of the
+    block in the text.
+
+    """
+    def __init__(self, kind, start, end):
+        self.kind = kind
+        self.start = start
+        self.end = end
+
+
+def findUnits(text):
+    """Returns a list of the Units in the LilyPond document text.
+
+    Returns None if the document can't be split, because it contains a \\book
+    or toplevel music or markup outside the \\score and \\bookpart blocks,
+    which would end up in every unit.
+
+    """
+    tokenizer = ly.tokenize.Tokenizer()
+    toplevel = tokenizer.depth()
+    units = []
+    unit = None         # the kind and start of the unit being read
+    name = False        # read a word that could be the name of an assignment
+    value = False       # reading the value of an assignment
+    depth = toplevel
+    for token in tokenizer.tokens(text):
+        before, depth = depth, tokenizer.depth()
+        if unit:
+            if depth == toplevel and before != toplevel:
+                units.append(Unit(unit[0], unit[1], token.end))
+                unit = None
+            continue
+        if before != toplevel:
+            if depth == toplevel:
+                value = False   # a nested value of an assignment has ended
+            continue
+        if isinstance(token, (tokenizer.Space, tokenizer.Comment)):
+            continue
+        if name and token != '=':
+            return # toplevel music
+        name = False
+        if token == '=':
+            value = True
+        elif token in ('\\score', '\\bookpart') and not value:
+            unit = (token[1:], token.pos)
+        elif token == '\\book':
+            return
+        elif isinstance(token, (tokenizer.PitchWord, tokenizer.Dynamic,
+                                tokenizer.Unparsed)):
+            name = not value
+        elif value or token in _safeCommands or isinstance(token, (
+                tokenizer.Section, tokenizer.Include, tokenizer.Language,
+                tokenizer.Scheme, tokenizer.String)):
+            continue
+        else:
+            return # toplevel music or markup
+    if unit or name:
+        return
+    return units
+
+def unitText(text, units, index, filename=None, firstPage=1):
+    """Returns the text to compile the unit with the given index.
+
+    All other units are replaced with whitespace, keeping the line numbers.
+    If filename is given, LilyPond is told that the text comes from that
+    file. If firstPage is greater than 1, the pages are numbered from there.
+
+    """
+    parts = []
+    pos = 0
+    for i, unit in enumerate(units):
+        parts.append(text[pos:unit.start])
+        block = text[unit.start:unit.end]
+        if i != index:
+            block = re.sub(r'[^\r\n]', ' ', block)
+        parts.append(block)
+        pos = unit.end
+    parts.append(text[pos:])
+    if filename:
+        parts.insert(0, '\\sourcefilename "{0}" '.format(
+            filename.replace('\\', '\\\\').replace('"', '\\"')))
+    if firstPage > 1:
+        parts.append('\n\\paper {{ first-page-number = {0} '
+                     'print-first-page-number = ##t }}\n'.format(firstPage))
+    return ''.join(parts)
+
+def pageCount(pdf):
+    """Returns the number of pages in the PDF file, or None if unknown.
+
+    The /Count of the root of the page tree is read. If that object is in a
+    compressed object stream, Ghostscript is asked.
+
+    """
+    try:
+        with open(pdf, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return None
+    for obj in re.findall(br'\bobj\b(.*?)\bendobj\b', data, re.DOTALL):
+        if re.search(br'/Type\s*/Pages\b', obj) and b'/Parent' not in obj:
+            m = re.search(br'/Count\s+(\d+)', obj)
+            if m:
+                return int(m.group(1))
+    return _gsPageCount(pdf)
+
+def _gsPageCount(pdf):
+    """Asks Ghostscript for the number of pages in the PDF file."""
+    name = pdf.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    cmd = [combineCommand[0], '-q', '-dNODISPLAY', '-dNOSAFER', '-c',
+           '({0}) (r) file runpdfbegin pdfpagecount = quit'.format(name)]
+    try:
+        output = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+            stderr=open(os.devnull, 'w')).communicate()[0]
+    except OSError:
+        return None
+    output = output.strip()
+    return output.isdigit() and int(output) or None
+
+
+class Build(object):
+    """An incremental build of a LilyPond document, one unit at a time.
+
+    The units are written to files in directory, that is kept between builds.
+    For every unit, call write() and compile the file it returns. When it is
+    done, call finished(). Then call assemble() to combine the outputs.
+
+    """
+    def __init__(self, lyfile, directory, text=None):
+        self.lyfile = os.path.abspath(lyfile)
+        self.directory = directory
+        if text is None:
+            with open(self.lyfile) as f:
+                text = f.read().decode('utf-8')
+        self.text = text
+        self.units = findUnits(text)
+        self.pages = []         # the number of pages of every finished unit
+        self.rebuilt = []       # the indices of the units that were compiled
+
+    def filename(self, index):
+        """Returns the name of the file for the unit with the given index."""
+        return os.path.join(self.directory, 'unit{0}.ly'.format(index + 1))
+
+    def write(self, index):
+        """Writes the unit with the given index and returns the filename.
+
+        The file is only written if its contents changed, so the units that
+        did not change keep their old modification time.
+
+        """
+        firstPage = 1
+        if None not in self.pages[:index]:
+            firstPage += sum(self.pages[:index])
+        text = unitText(self.text, self.units, index, self.lyfile, firstPage)
+        data = text.encode('utf-8')
+        filename = self.filename(index)
+        try:
+            with open(filename, 'rb') as f:
+                if f.read() == data:
+                    return filename
+        except IOError:
+            pass
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    def finished(self, index, rebuilt=True):
+        """Call this when the unit with the given index has been compiled.
+
+        rebuilt is False if the output was taken from a cache. Returns False
+        if the number of pages of the unit is unknown, in which case the
+        pages of the following units can't be numbered correctly.
+
+        """
+        del self.pages[index:]
+        self.pages.append(pageCount(self.output(index, 'pdf')))
+        if rebuilt:
+            self.rebuilt.append(index)
+        return self.pages[-1] is not None
+
+    def output(self, index, ext):
+        """Returns the output file with extension ext of a unit."""
+        return os.path.splitext(self.filename(index))[0] + '.' + ext
+
+    def outputs(self, index, ext):
+        """Returns all output files with extension ext of a unit, in order."""
+        base = os.path.splitext(os.path.basename(self.filename(index)))[0]
+        pat = re.compile(r'{0}(-(\d+))?\.{1}$'.format(re.escape(base),
+                                                      re.escape(ext)))
+        files = []
+        for f in os.listdir(self.directory):
+            m = pat.match(f)
+            if m:
+                files.append((int(m.group(2) or 0), f))
+        return [os.path.join(self.directory, f) for n, f in sorted(files)]
+
+    def assemble(self):
+        """Puts the output of the units in the directory of the document.
+
+        The MIDI files are copied and numbered like LilyPond would have done.
+        Returns the command (a list) that combines the PDF files, or None if
+        there was only one PDF file (which is copied).
+
+        """
+        directory, name = os.path.split(self.lyfile)
+        base = os.path.join(directory, os.path.splitext(name)[0])
+        midis = []
+        for index in range(len(self.units)):
+            midis.extend(self.outputs(index, 'midi'))
+        for num, midi in enumerate(midis):
+            shutil.copyfile(midi, '{0}{1}.midi'.format(base,
+                '-{0}'.format(num) if num else ''))
+        pdfs = [self.output(index, 'pdf') for index in range(len(self.units))]
+        pdfs = [pdf for pdf in pdfs if os.path.exists(pdf)]
+        if len(pdfs) == 1:
+            shutil.copyfile(pdfs[0], base + '.pdf')
+        elif pdfs:
+            return combineCommand + ['-sOutputFile=' + base + '.pdf'] + pdfs
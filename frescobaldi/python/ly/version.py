@@ -23,7 +23,7 @@ from __future__ import unicode_literals
 LilyPond version information
 """
 
-import os, re, weakref
+import os, re, threading, weakref
 from functools import wraps
 from subprocess import Popen, PIPE, STDOUT
 
@@ -91,7 +91,96 @@ class Version(tuple):
         if match:
             return cls(*map(lambda g: int(g) if g else None, match.groups()))
 
-            
+
+class ProbeCache(object):
+    """
+    Stores the information LilyPondInstance gets by running programs,
+    such as the version, so it need not be run again in a next session.
+
+    The results are stored per resolved path of the program that was run,
+    together with its inode, modification time and size. If the program
+    changes (e.g. because LilyPond was upgraded), its results are discarded.
+
+    If filename is given, the cache is loaded from that file and written
+    back there every time a result is added.
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._programs = {}  # path -> (signature, {name: value})
+        if filename:
+            self.load(filename)
+
+    @staticmethod
+    def signature(path):
+        """
+        Returns (resolved path, signature) for the program at path,
+        or (None, None) if it does not exist.
+        """
+        try:
+            path = os.path.realpath(path)
+            s = os.stat(path)
+        except (OSError, TypeError, AttributeError):
+            return None, None
+        return path, (s.st_ino, s.st_mtime, s.st_size)
+
+    def get(self, program, name):
+        """
+        Returns the stored result name of program.
+        Raises KeyError if there is no result or the program has changed.
+        """
+        path, signature = self.signature(program)
+        with self._lock:
+            sig, values = self._programs[path]
+            if sig != signature:
+                raise KeyError(name)
+            value = values[name]
+        return Version(*value) if isinstance(value, tuple) else value
+
+    def set(self, program, name, value):
+        """ Stores the result name of program. """
+        path, signature = self.signature(program)
+        if path is None:
+            return
+        if isinstance(value, Version):
+            value = tuple(value)
+        with self._lock:
+            sig, values = self._programs.get(path, (None, {}))
+            if sig != signature:
+                values = {}
+            values[name] = value
+            self._programs[path] = (signature, values)
+            if self.filename:
+                self.save(self.filename)
+
+    def load(self, filename):
+        """ Loads the cache. Missing or unreadable files are ignored. """
+        import cPickle
+        try:
+            with open(filename, 'rb') as f:
+                programs = cPickle.load(f)
+        except Exception:
+            return
+        if isinstance(programs, dict):
+            with self._lock:
+                self._programs.update(programs)
+
+    def save(self, filename):
+        """ Writes the cache to filename. """
+        import cPickle
+        temp = filename + '.tmp'
+        try:
+            with open(temp, 'wb') as f:
+                cPickle.dump(self._programs, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp, filename)
+        except (IOError, OSError):
+            pass
+
+
+# The ProbeCache used by all LilyPondInstances, if set.
+probeCache = None
+
+
 class LilyPondInstance(object):
     """
     Contains information about a LilyPond instance, referred to by a command
@@ -164,11 +253,37 @@ class LilyPondInstance(object):
         if cmd:
             return os.path.dirname(os.path.dirname(cmd))
         
+    def _probe(self, program, name, func):
+        """
+        Returns the result of func(), looked up in or stored in the
+        probeCache (if set) under the given program and name.
+        """
+        cache = probeCache
+        if cache is None or not program:
+            return func()
+        try:
+            return cache.get(program, name)
+        except KeyError:
+            value = func()
+            cache.set(program, name, value)
+            return value
+
+    def probe(self):
+        """
+        Determines (and caches) all information that needs running programs.
+        """
+        self.version()
+        self.datadir()
+        self.lastConvertLyRuleVersion()
+
     @cacheresult
     def version(self):
         """
         Returns the version returned by command -v as an instance of Version.
         """
+        return self._probe(self.command(), 'version', self._version)
+
+    def _version(self):
         try:
             output = Popen((self._command, '-v'), stdout=PIPE, stderr=STDOUT).communicate()[0]
             return Version.fromString(output)
@@ -181,6 +296,9 @@ class LilyPondInstance(object):
         Returns the datadir of this LilyPond instance. Most times something
         like "/usr/share/lilypond/2.13.3/"
         """
+        return self._probe(self.command(), 'datadir', self._datadir)
+
+    def _datadir(self):
         # First ask LilyPond itself.
         try:
             d = Popen((self._command, '-e',
@@ -207,6 +325,10 @@ class LilyPondInstance(object):
         Returns the version of the last convert-ly rule of this lilypond
         instance.
         """
+        return self._probe(self.convert_ly(), 'lastConvertLyRuleVersion',
+            self._lastConvertLyRuleVersion)
+
+    def _lastConvertLyRuleVersion(self):
         try:
             output = Popen((self.convert_ly(), '--show-rules'), stdout=PIPE).communicate()[0]
             for line in reversed(output.splitlines()):
@@ -227,6 +349,42 @@ class LilyPondInstance(object):
             font = os.path.join(datadir, "fonts", "svg", fontname + ".svg")
             if os.path.exists(font):
                 import ly.font
-                return ly.font.SvgFontInfo(font)
+                index = None
+                if ly.font.indexDirectory:
+                    index = os.path.join(ly.font.indexDirectory,
+                        "{0}-{1}.index".format(fontname, self.version()))
+                return ly.font.SvgFontInfo(font, index)
             
 
+
+def probe(commands, wait=True):
+    """
+    Probes the LilyPond instances for the given commands in parallel,
+    using one thread per instance. Every instance is probed only once.
+
+    If wait is False, returns immediately, and the probing continues in the
+    background, so the results are ready (or in the probeCache) when they
+    are needed. Returns the list of threads.
+    """
+    threads = []
+    for command in commands:
+        instance = LilyPondInstance(command)
+        t = instance.__dict__.get('_probeThread')
+        if t is None:
+            t = instance._probeThread = threading.Thread(target=instance.probe)
+            t.daemon = True
+            t.start()
+        threads.append(t)
+    if wait:
+        for t in threads:
+            t.join()
+    return threads
+
+def versions(commands):
+    """
+    Returns a dictionary mapping each command to the version of its
+    LilyPond instance (or None). Unknown versions are determined in parallel.
+    """
+    probe(commands)
+    return dict((command, LilyPondInstance(command).version())
+        for command in commands)
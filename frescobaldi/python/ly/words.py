@@ -23,6 +23,9 @@ from __future__ import unicode_literals
 LilyPond reserved words for auto completion, and some regexps
 """
 
+import bisect
+import heapq
+import itertools
 import re
 
 keywords = (
@@ -1121,9 +1124,9 @@ def schemeprops(grob = None):
     """
     # FIXME:
     # - get those from LilyPond
-    # - return only properties relevant to the grob
+    # - fill grob_properties with only the properties relevant to each grob
     # - do something with the embedded documentation
-    return all_user_grob_properties
+    return grob_properties.get(grob, all_user_grob_properties)
 
 
 all_user_grob_properties = (
@@ -1761,6 +1764,64 @@ mark_formatters = (
 )
 
 
+# grob name -> the scheme properties it supports
+grob_properties = dict.fromkeys(grobs, all_user_grob_properties)
+
+
+class WordIndex(object):
+    """
+    An immutable, sorted index over one or more word lists, without
+    duplicates, to quickly find the words starting with a prefix.
+
+    It can be used as a sequence of all its words.
+    """
+    def __init__(self, *wordlists):
+        self.words = tuple(sorted(set(itertools.chain(*wordlists))))
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, index):
+        return self.words[index]
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __contains__(self, word):
+        i = bisect.bisect_left(self.words, word)
+        return i < len(self.words) and self.words[i] == word
+
+    def range(self, prefix):
+        """ Returns the slice (start, end) of the words starting with prefix. """
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + '\uffff', start)
+        return start, end
+
+    def prefix(self, prefix):
+        """ Returns a tuple of the words starting with prefix, sorted. """
+        start, end = self.range(prefix)
+        return self.words[start:end]
+
+    def ranked(self, prefix, limit = None):
+        """
+        Returns a list of the words starting with prefix, the exact match
+        (if any) first, then the shorter words before the longer ones.
+        If limit is given, at most that many words are returned.
+        """
+        start, end = self.range(prefix)
+        if limit is not None and limit < end - start:
+            return heapq.nsmallest(limit, self.words[start:end], key=len)
+        return sorted(self.words[start:end], key=len)
+
+
+# indices of word lists that are offered together for completion
+commands_index = WordIndex(
+    keywords, keywords_completion, musiccommands, musiccommands_completion)
+markupallcommands_index = WordIndex(markupcommands, markuplistcommands)
+contexts_properties_index = WordIndex(contexts, contextproperties)
+contexts_grobs_index = WordIndex(contexts, grobs)
+
+
 set_context_re = re.compile(r'\\(un)?set\s+(' + '|'.join(contexts) + r')\s*.\s*$')
 context_re = re.compile(r'\b(' + '|'.join(contexts) + r')\s*\.\s*$')
 grob_re = re.compile(r'\b(' + '|'.join(grobs) + r')\s*$')
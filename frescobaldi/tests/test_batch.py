@@ -0,0 +1,49 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+""" Tests for ly.batch """
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python'))
+
+import ly.batch
+
+
+class TranslateTest(unittest.TestCase):
+    def translate(self, text, lang='english'):
+        return ly.batch.translate(text, lang).apply()
+
+    def testAddLanguage(self):
+        self.assertEqual(self.translate('\\version "2.14.0"\n{ c fis bes }\n'),
+            '\\version "2.14.0"\n\\language "english"\n{ c fs bf }\n')
+
+    def testAddIncludeForOldVersion(self):
+        self.assertEqual(self.translate('\\version "2.12.3"\n{ fis }\n'),
+            '\\version "2.12.3"\n\\include "english.ly"\n{ fs }\n')
+
+    def testChangeLanguage(self):
+        self.assertEqual(self.translate('\\language "deutsch"\n{ fis b }\n'),
+            '\\language "english"\n{ fs bf }\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
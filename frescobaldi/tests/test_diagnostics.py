@@ -0,0 +1,55 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+""" Tests for ly.diagnostics """
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python'))
+
+import ly.diagnostics
+
+
+class FeedTest(unittest.TestCase):
+    line = "/home/u/My Scores/inc.ly:3:2: error: bad\n"
+
+    def testSplitAtEveryOffset(self):
+        for offset in range(len(self.line) + 1):
+            parser = ly.diagnostics.Parser('/')
+            pieces = parser.feed(self.line[:offset])
+            pieces += parser.feed(self.line[offset:])
+            pieces += parser.flush()
+            self.assertEqual(''.join(text for text, ref in pieces), self.line)
+            refs = [ref for text, ref in pieces if ref]
+            self.assertEqual(refs, [("/home/u/My Scores/inc.ly", 3, 2)],
+                "offset {0}".format(offset))
+            self.assertEqual(len(parser.diagnostics), 1)
+
+    def testProgressIsNotHeldBack(self):
+        parser = ly.diagnostics.Parser()
+        self.assertEqual(parser.feed("Parsing..."), [("Parsing...", None)])
+        parser.feed("\n")
+        for text in ("Interpreting music... ", "[8]", "[16]"):
+            self.assertEqual(parser.feed(text), [(text, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
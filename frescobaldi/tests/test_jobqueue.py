@@ -0,0 +1,117 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+""" Tests for jobqueue """
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python'))
+
+from signals import Signal
+import jobqueue
+
+
+class Job(object):
+    done = Signal(fireOnce=True)
+
+    def __init__(self, fail=False, document=None):
+        self.fail = fail
+        self.document = document
+        self.started = False
+
+    def start(self):
+        if self.fail:
+            raise RuntimeError("could not start")
+        self.started = True
+
+    def finish(self):
+        self.done(True, self)
+
+
+class DocumentQueue(jobqueue.JobQueue):
+    """Allows one job per document, cleaning up like mainapp.JobManager."""
+    def __init__(self, maxJobs):
+        super(DocumentQueue, self).__init__(maxJobs)
+        self.jobs = {}
+
+    def run(self, job):
+        if job.document in self.jobs:
+            return False
+        self.jobs[job.document] = job
+        self.add(job)
+        return True
+
+    def _finished(self, success, job):
+        del self.jobs[job.document]
+        super(DocumentQueue, self)._finished(success, job)
+
+    def _cancelled(self, job):
+        del self.jobs[job.document]
+        super(DocumentQueue, self)._cancelled(job)
+
+
+class StartFailureTest(unittest.TestCase):
+    def testFailedStartFreesPlace(self):
+        queue = jobqueue.JobQueue(1)
+        finished = []
+        queue.jobFinished.connect(lambda job, success: finished.append(success))
+        bad, good = Job(fail=True), Job()
+        queue.add(good)
+        queue.add(bad)
+        self.assertRaises(RuntimeError, good.finish)
+        self.assertEqual(finished, [True, False])
+        self.assertEqual(queue.count(), 0)
+        later = Job()
+        queue.add(later)
+        self.assertTrue(later.started)
+
+    def testOtherJobsStillStart(self):
+        queue = jobqueue.JobQueue(2)
+        self.assertRaises(RuntimeError, queue.add, Job(fail=True))
+        job = Job()
+        queue.add(job)
+        self.assertTrue(job.started)
+        self.assertEqual(queue.running(), [job])
+
+    def testFailedJobReleasesDocument(self):
+        queue = DocumentQueue(1)
+        self.assertRaises(RuntimeError, queue.run, Job(fail=True, document='a'))
+        self.assertEqual(queue.jobs, {})
+        job = Job(document='a')
+        self.assertTrue(queue.run(job))
+        self.assertTrue(job.started)
+
+    def testFailedWaitingJobReleasesDocument(self):
+        queue = DocumentQueue(1)
+        first = Job(document='a')
+        queue.run(first)
+        queue.run(Job(fail=True, document='b'))
+        queue.run(Job(document='c'))
+        self.assertRaises(RuntimeError, first.finish)
+        self.assertEqual(list(queue.jobs), ['c'])
+        self.assertTrue(queue.jobs['c'].started)
+        job = Job(document='b')
+        self.assertTrue(queue.run(job))
+        self.assertFalse(job.started)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008, 2009, 2010 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+from __future__ import unicode_literals
+
+""" Tests for ly.tools """
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python'))
+
+import ly.pitch
+import ly.tokenize
+import ly.tools
+
+
+class RecordingTokenizer(ly.tokenize.MusicTokenizer):
+    """ Remembers the position of the first token it returned. """
+    first = None
+    def tokens(self, text, pos=0):
+        for token in super(RecordingTokenizer, self).tokens(text, pos):
+            if self.first is None:
+                self.first = token.pos
+            yield token
+
+
+def seededTokenizer(text, start):
+    """ Returns a MusicTokenizer in the state it has at start of text. """
+    tokenizer = ly.tokenize.Tokenizer()
+    for token in tokenizer.tokens(text[:start]):
+        pass
+    seeded = RecordingTokenizer()
+    seeded.thaw(tokenizer.freeze())
+    return seeded
+
+
+class TransposeTest(unittest.TestCase):
+    def transpose(self, text, start, tokenizer=None):
+        c, g = ly.pitch.Pitch(), ly.pitch.Pitch()
+        g.note = 4
+        transposer = ly.pitch.Transposer(c, g)
+        return ly.tools.transpose(text, transposer, start,
+            tokenizer=tokenizer).apply()
+
+    def testSelectionInRelative(self):
+        text = "\\relative c' { c d e f g a b c e g b d }"
+        start = text.index(' e ') + 1
+        expected = "\\relative c' { c d b' c d e fis g b d fis a }"
+        self.assertEqual(self.transpose(text, start), expected)
+        self.assertEqual(self.transpose(text, start,
+            seededTokenizer(text, start)), expected)
+
+    def testSelectionInAbsolute(self):
+        text = "{ c' d' } { e' f' }"
+        start = text.index('{', 1)
+        expected = "{ c' d' } { b' c'' }"
+        self.assertEqual(self.transpose(text, start), expected)
+        self.assertEqual(self.transpose(text, start,
+            seededTokenizer(text, start)), expected)
+
+    def testSelectionAfterClosedRelative(self):
+        text = "\\relative c' { c d } % \\relative\n{ e' f' }"
+        start = text.index('{', text.index('}'))
+        expected = "\\relative c' { c d } % \\relative\n{ b' c'' }"
+        tokenizer = seededTokenizer(text, start)
+        self.assertEqual(self.transpose(text, start, tokenizer), expected)
+        self.assertEqual(tokenizer.first, start)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,6 +34,11 @@ from lilykde.log import log
 # Translate the messages
 from lilykde.i18n import _
 
+try:
+    from ly.parse import includeGraph
+except ImportError:
+    includeGraph = None
+
 def pdftk():
     """ Returns the Pdftk command. """
     return config("commands").get('pdftk', 'pdftk')
@@ -51,13 +56,25 @@ def find_included_files(filename, directory):
     Until LilyPond supports recursive relative include paths,
     all paths are assumed to be relative to the directory of the
     given LilyPond source file.
+
+    If Frescobaldi's ly package is available, its cached include graph
+    is used, which also finds recursive relative includes.
     """
     full = os.path.join(directory, filename)
-    if os.access(full, os.R_OK):
-        yield filename
-        for f in re.findall(r'\\include\s*"([^"]+)"', file(full).read()):
-            for p in find_included_files(f, directory):
-                yield p
+    if includeGraph is not None:
+        for f in includeGraph.find(full):
+            yield os.path.relpath(f, directory or os.curdir)
+        return
+    seen = set()
+    pending = [filename]
+    while pending:
+        filename = os.path.normpath(pending.pop())
+        full = os.path.join(directory, filename)
+        if filename not in seen and os.access(full, os.R_OK):
+            seen.add(filename)
+            yield filename
+            pending.extend(reversed(
+                re.findall(r'\\include\s*"([^"]+)"', file(full).read())))
 
 def attach_files(ly, wait = 0):
     """
@@ -39,6 +39,11 @@ from lilykde import config
 # Translate the messages
 from lilykde.i18n import _
 
+try:
+    from ly.diagnostics import Parser
+except ImportError:
+    Parser = None
+
 
 # Classes
 
@@ -93,13 +98,23 @@ class Outputter:
     """
     Collects data and as soon as a newline is found,
     sends it to a logger
+
+    If Frescobaldi's ly package is available, its diagnostics parser
+    does the buffering, and the errors and warnings LilyPond printed
+    are available in the diagnostics list.
     """
     def __init__(self, log, f, color=None):
         self.log, self.f, self.color = log, f, color
         self.buf = []
+        self.parser = Parser and Parser(f.directory)
 
     def receive(self, proc, buf, length):
-        l = unicode(QString.fromUtf8(buf, length)).split("\n")
+        text = unicode(QString.fromUtf8(buf, length))
+        if self.parser:
+            for line in self.parser.lines(text):
+                self.output(line)
+            return
+        l = text.split("\n")
         self.buf.append(l[0])
         if len(l) > 1:
             self.output("".join(self.buf))
@@ -107,6 +122,10 @@ class Outputter:
                 self.output(i)
             self.buf = [l[-1]]
 
+    def diagnostics(self):
+        """ Returns the list of diagnostics, if the parser is available. """
+        return self.parser and self.parser.diagnostics or []
+
     _editstr = re.compile(r"^(.*?):(\d+):(?:(\d+):)?").sub
 
     def output(self, line):
@@ -126,7 +145,10 @@ class Outputter:
             (encodeurl(file), line, col, col, m.group())
 
     def close(self):
-        s = "".join(self.buf)
+        if self.parser:
+            s = self.parser.finish()
+        else:
+            s = "".join(self.buf)
         if s:
             self.log.append(s, self.color)
 